@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# benchmarks/bench_generation.py
+"""Benchmark of the exam generation pipeline on synthetic question banks.
+
+Usage:
+    python benchmarks/bench_generation.py [--sizes 1000 10000 100000]
+        [--density 0.1] [--repeat 5] [--output results.json]
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from exam import exam as E
+from exam.bank import QuestionBank
+from exam.sampler import selectQuestions
+from exam.storage import openStorage, DirectoryStorage, SQLiteStorage
+from exam.version import __version__
+
+
+_PREFIXES_PER_DIR = 5
+_QUESTIONS_PER_DIR = 5000
+_ALTERNATIVES = 5
+_EXAM_DIRS = 5
+_EXAM_QUESTIONS_PER_PREFIX = 2
+
+
+############################################################################
+# Creates a synthetic bank of n questions in path, layout
+# <path>/<dir>/<prefix>_qNNNN.tex, returns the restrictions
+############################################################################
+def createBank(path, n, density, rng):
+
+	dirs = max(1, n // _QUESTIONS_PER_DIR)
+	per_prefix = n // (dirs * _PREFIXES_PER_DIR)
+	groups = dict()
+	for d in range(dirs):
+		d_name = "dir{:03d}".format(d)
+		os.makedirs(path + d_name)
+		for p in range(_PREFIXES_PER_DIR):
+			prefix = "{}_P{}".format(d_name, p)
+			names = []
+			for q in range(1, per_prefix+1):
+				name = "{}_q{:04d}".format(prefix, q)
+				names.append(name)
+				with open(path + d_name + "/" + name + ".tex", "w") as f:
+					f.write("Statement of question {}\n\n[alternatives]\n".format(name))
+					f.write("\n//\n".join(("* " if a == 0 else "") + "Alternative {}".format(a) for a in range(_ALTERNATIVES)))
+					f.write("\n")
+			groups[(d_name, prefix)] = names
+
+	# restrictions: groups of 2 or 3 questions of the same prefix, covering density of the bank
+	restrictions = []
+	for names in groups.values():
+		count = int(len(names) * density / 2.5)
+		for i in range(count):
+			restrictions.append(rng.sample(names, rng.choice([2, 3])))
+	return groups, restrictions
+
+############################################################################
+# Configuration (config.yaml) and exam of the synthetic bank
+############################################################################
+def createConfig(cwd, questions, cache, restrictions):
+	with open(cwd + "config.yaml", "w") as f:
+		json.dump({"config": {"locale": "en", "questions": {"path": questions}, "cache": {"path": cache}, "restrictions": restrictions}}, f)
+
+def examConfig(groups):
+	dirs = sorted({d for d, p in groups})[:_EXAM_DIRS]
+	questions = dict()
+	for d, p in sorted(groups):
+		if d in dirs:
+			questions.setdefault(d, dict())[p] = _EXAM_QUESTIONS_PER_PREFIX
+	return {
+		"exam": {"total_score": 100, "class": "BENCHMARK", "name": "BENCHMARK", "date": "01/01/2000", "balanced_questions": 1},
+		"questions": questions
+	}
+
+############################################################################
+# Copies of the bank in a zip archive and a SQLite database
+############################################################################
+def createStorages(root, questions):
+	shutil.make_archive(root + "/questions", "zip", root, "questions")
+	storage = DirectoryStorage(questions)
+	directories, loose = storage.list()
+	keys = [(d, name) for d in directories for name, mtime, size in directories[d]]
+	texts = storage.get_many(keys)
+	stats = {(d, name): mtime for d in directories for name, mtime, size in directories[d]}
+	SQLiteStorage(root + "/questions.sqlite").put_many({key: (stats[key], texts[key]) for key in keys})
+
+# bank of location listed, then the questions keys read in one call
+def fetch(location, keys):
+	bank = QuestionBank(location, None, openStorage(location))
+	bank.refresh()
+	bank.fetch(keys)
+
+############################################################################
+# Helper : time of fn (seconds), repeated
+############################################################################
+def measure(fn, repeat):
+	times = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		fn()
+		times.append(time.perf_counter() - start)
+	return {"min": min(times), "median": statistics.median(times), "repeat": repeat}
+
+############################################################################
+# Time each stage of the pipeline for a bank of n questions
+############################################################################
+def benchmark(n, density, repeat, seed):
+
+	rng = random.Random(seed)
+	root = tempfile.mkdtemp(prefix="exam_bench_")
+	try:
+		questions = root + "/questions/"
+		cwd = root + "/work/"
+		os.makedirs(cwd)
+		groups, restrictions = createBank(questions, n, density, rng)
+		createConfig(cwd, questions, root + "/cache/", restrictions)
+
+		stages = dict()
+		with contextlib.redirect_stdout(io.StringIO()):
+			config = E.loadConfig(cwd)
+			stages["loadBank_cold"] = measure(lambda: E.loadBank(config), 1)
+			stages["loadBank_warm"] = measure(lambda: E.loadBank(config), repeat)
+
+			exam = E.Exam(config, "bench", E.loadBank(config))
+			exam.examConfig = examConfig(groups)
+			exam.seed = seed
+			exam.rng = random.Random(seed)
+			os.makedirs(exam.EXAM_PATH)
+
+			stages["loadQuestions"] = measure(lambda: E.loadQuestions(exam), repeat)
+			stages["generateQuestions"] = measure(lambda: E.generateQuestions(exam), repeat)
+
+			# selection of questions under restrictions alone (sampler)
+			names = [[q for d, t, q in questions_type] for questions_type in exam.allQuestions]
+			stats = dict()
+			stages["selectQuestions"] = measure(lambda: selectQuestions(random.Random(seed), names, exam.quantities, config.conflicts, exam.labels, stats), repeat)
+			stages["selectQuestions"]["checks"] = stats["checks"]
+
+			stages["generateCorrectAnswers"] = measure(lambda: E.generateCorrectAnswers(exam), repeat)
+			stages["generateAlternatives"] = measure(lambda: E.generateAlternatives(exam), repeat)
+			stages["generateExamFile"] = measure(lambda: E.generateExamFile(exam), repeat)
+			stages["generateAnswersFiles"] = measure(lambda: E.generateAnswersFiles(exam), repeat)
+
+			# same exam with questions read from the pack file (exam pack)
+			E.commandPack(config)
+			stages["loadBank_pack"] = measure(lambda: E.loadBank(config), repeat)
+			exam.bank = E.loadBank(config)
+			stages["generateExamFile_pack"] = measure(lambda: E.generateExamFile(exam), repeat)
+
+			# list the bank and read the selected questions from each storage
+			keys = [(d, q) for d, t, q in exam.questions]
+			createStorages(root, questions)
+			for kind, location in (("directory", questions), ("zip", root + "/questions.zip"), ("sqlite", root + "/questions.sqlite")):
+				stages["fetch_" + kind] = measure(lambda: fetch(location, keys), repeat)
+
+		return {
+			"questions": n,
+			"restriction_density": density,
+			"restrictions": len(restrictions),
+			"exam_questions": exam.countExamQuestions,
+			"stages": stages
+		}
+	finally:
+		shutil.rmtree(root, ignore_errors=True)
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark of exam generation stages")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="questions in synthetic banks")
+	parser.add_argument("--density", type=float, default=0.1, help="fraction of questions in restrictions")
+	parser.add_argument("--repeat", type=int, default=5, help="repetitions of each stage")
+	parser.add_argument("--seed", type=int, default=1, help="seed of banks and exams")
+	parser.add_argument("--output", default="-", help="JSON file of results (- to stdout)")
+	args = parser.parse_args()
+
+	results = {
+		"version": __version__,
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"results": [benchmark(n, args.density, args.repeat, args.seed) for n in args.sizes]
+	}
+	text = json.dumps(results, indent=2)
+	if args.output == "-":
+		print(text)
+	else:
+		with open(args.output, "w") as f:
+			f.write(text + "\n")
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# benchmarks/bench_startup.py
+"""Startup budget of the exam CLI, checked with python -X importtime.
+
+Fails (exit 1) if importing exam takes longer than the budget or imports
+modules that must only be loaded by the commands that use them.
+
+Usage:
+    python benchmarks/bench_startup.py [--budget 200] [--repeat 5]
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# modules loaded on demand (config, translations, compilation, variants)
+_LAZY_MODULES = ["yaml", "gettext", "json", "subprocess", "concurrent.futures", "tracemalloc", "distutils", "pprint"]
+
+
+############################################################################
+# Run python -X importtime -c "import <module>", returns the imported
+# modules with their cumulative import time (microseconds)
+############################################################################
+def importTime(module):
+	env = dict(os.environ, PYTHONPATH=_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+	res = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+		env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+	modules = dict()
+	for line in res.stderr.splitlines():
+		# import time: self [us] | cumulative | imported package
+		parts = line.split("|")
+		if len(parts) != 3 or not parts[1].strip().isdigit():
+			continue
+		# last line of a module is its outermost import
+		modules[parts[2].strip()] = int(parts[1])
+	return modules
+
+def main():
+	parser = argparse.ArgumentParser(description="Startup budget of the exam CLI")
+	parser.add_argument("--budget", type=float, default=200, help="maximum import time of exam (ms)")
+	parser.add_argument("--repeat", type=int, default=5, help="runs, median is compared to budget")
+	args = parser.parse_args()
+
+	times = []
+	for i in range(args.repeat):
+		modules = importTime("exam.exam")
+		times.append(modules["exam.exam"] / 1000)
+	median = statistics.median(times)
+	# modules imported by the CLI framework itself are not ours to defer
+	typer = importTime("typer")
+	lazy = [m for m in _LAZY_MODULES if m in modules and m not in typer]
+
+	print(json.dumps({"import_ms": {"median": median, "min": min(times)}, "budget_ms": args.budget, "eager_modules": lazy}, indent=2))
+	if lazy:
+		print("Modules imported at startup, should be imported on demand: " + ", ".join(lazy), file=sys.stderr)
+	if median > args.budget:
+		print("Import of exam took {:.1f} ms, budget is {:.1f} ms".format(median, args.budget), file=sys.stderr)
+	return 1 if lazy or median > args.budget else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -1,3 +1,4 @@
 """Top-level package for EXAM."""
 # exam/__init__.py
 
+from .exam import Config, Exam, ExamBuilder, loadConfig
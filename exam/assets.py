@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/assets.py
+"""Content-addressed store of template assets shared by exam folders."""
+
+import os
+import stat
+import shutil
+import hashlib
+
+from .files import copyFile
+
+try:
+	import fcntl
+except ImportError:
+	# not available on Windows
+	fcntl = None
+
+
+_FICLONE = 0x40049409   # Linux ioctl: reflink (copy-on-write clone) of a file
+_READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+# how an asset was put in an exam folder
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+COPY = "copy"
+
+
+############################################################################
+# Reflink src to dst, raises OSError if the file system can not do it
+############################################################################
+def reflink(src, dst):
+	if fcntl is None:
+		raise OSError("reflink not supported")
+	try:
+		with open(src, "rb") as fin, open(dst, "wb") as fout:
+			fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+	except OSError:
+		if os.path.exists(dst):
+			os.remove(dst)
+		raise
+
+############################################################################
+# Assets stored once by contents (path/<sha1><extension>) and linked into
+# exam folders. Stored files are read only: a hard link shares the file
+# with every exam, so it must not be edited in place.
+############################################################################
+class AssetStore:
+
+	def __init__(self, path):
+		self.path = path
+		self.hashes = dict()   # source file -> (mtime, size, stored file)
+
+	############################################################################
+	# Stored file with the contents of filename, adding it if needed
+	############################################################################
+	def add(self, filename):
+		st = os.stat(filename)
+		cached = self.hashes.get(filename)
+		if cached is not None and cached[0] == st.st_mtime and cached[1] == st.st_size and os.path.exists(cached[2]):
+			return cached[2]
+
+		h = hashlib.sha1()
+		with open(filename, "rb") as f:
+			for block in iter(lambda: f.read(65536), b""):
+				h.update(block)
+		stored = self.path + h.hexdigest() + os.path.splitext(filename)[1]
+		if not os.path.exists(stored):
+			copyFile(filename, stored, _READ_ONLY)
+		self.hashes[filename] = (st.st_mtime, st.st_size, stored)
+		return stored
+
+	############################################################################
+	# Put the contents of filename in folder destination (same name), as a
+	# reflink, a hard link or a copy; returns how
+	############################################################################
+	def stage(self, filename, destination):
+		target = destination + os.path.basename(filename)
+		if os.path.lexists(target):
+			os.remove(target)
+		try:
+			stored = self.add(filename)
+		except OSError:
+			# store not writable, plain copy
+			shutil.copy(filename, target)
+			return COPY
+		try:
+			reflink(stored, target)
+			return REFLINK
+		except OSError:
+			pass
+		try:
+			os.link(stored, target)
+			return HARDLINK
+		except OSError:
+			pass
+		shutil.copyfile(stored, target)
+		return COPY
+
+	############################################################################
+	# Remove stored assets not linked by any exam folder, returns how many
+	# (reflinked and copied files do not depend on the store)
+	############################################################################
+	def prune(self):
+		removed = 0
+		if not os.path.isdir(self.path):
+			return removed
+		for f in os.listdir(self.path):
+			try:
+				if os.stat(self.path + f).st_nlink <= 1:
+					os.remove(self.path + f)
+					removed += 1
+			except OSError:
+				continue
+		return removed
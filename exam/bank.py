@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/bank.py
+"""Question bank index, parsed questions cached on disk by file mtime.
+
+Files are listed from the storage of the bank (storage.py) on refresh, but
+read only when their questions are used: fetch() reads many of them in one
+call, get() one.
+"""
+
+import os
+import re
+import threading
+
+from .storage import DirectoryStorage
+from .files import writeCacheFile
+
+
+_INDEX_VERSION = 1
+_QUESTION_EXTENSION = ".tex"
+_ALTERNATIVES_SESSION = "[alternatives]"
+_ALTERNATIVES_SEPARATOR = "//"
+_CORRECT_MARK = "*"
+_QUESTION_REGEX = r"(^[A-Za-z0-9_]+)_q[0-9]+\.tex"
+
+
+############################################################################
+# Parse the text of a question : statement, alternatives and correct one
+# correct is the index of the alternative marked with *, or None
+############################################################################
+def parseQuestion(text):
+
+	alts = text.find(_ALTERNATIVES_SESSION)
+	if alts < 0:
+		return text.strip(), [], None
+
+	statement = text[:alts].strip()
+	alternatives = []
+	correct = None
+	for a in text[alts+len(_ALTERNATIVES_SESSION):].split(_ALTERNATIVES_SEPARATOR):
+		a = a.strip()
+		if a.startswith(_CORRECT_MARK):
+			a = a[len(_CORRECT_MARK):].strip()
+			if correct is None:
+				correct = len(alternatives)
+		alternatives.append(a)
+	return statement, alternatives, correct
+
+############################################################################
+# Prefix (question type) of a question file name, or None
+############################################################################
+def questionPrefix(filename):
+	res = re.search(_QUESTION_REGEX, filename)
+	if res:
+		return res.group(1)
+	return None
+
+############################################################################
+# Index of all questions of path, persisted in indexFile
+############################################################################
+class QuestionBank:
+
+	def __init__(self, path, indexFile=None, storage=None):
+		self.path = path
+		self.indexFile = indexFile
+		self.storage = storage if storage is not None else DirectoryStorage(path)
+		self.directories = dict()   # directory -> { question id -> entry }
+		self.loose = []             # files outside directories (not counted)
+		self.scanned = 0            # files scanned in last refresh
+		self.parsed = 0             # files read and parsed (fetched)
+		self.prefixIndex = dict()   # directory -> { prefix -> sorted ids }, built on demand
+		self.dirty = False          # questions fetched since index was saved
+		self.lock = threading.Lock()
+
+	############################################################################
+	# Loads index file, refresh entries of changed files and save it
+	############################################################################
+	def load(self):
+		self.loadIndex()
+		if self.refresh():
+			self.save()
+		return self
+
+	def loadIndex(self):
+		import json
+		if self.indexFile is None or not os.path.exists(self.indexFile):
+			return
+		try:
+			with open(self.indexFile, "r", encoding="utf-8") as f:
+				index = json.load(f)
+		except (OSError, ValueError):
+			return
+		if index.get("version") != _INDEX_VERSION or index.get("path") != self.path:
+			return
+		for entry in index["questions"]:
+			self.directories.setdefault(entry["directory"], dict())[entry["id"]] = entry
+
+	def save(self):
+		import json
+		self.dirty = False
+		if self.indexFile is None:
+			return
+		index = {
+			"version": _INDEX_VERSION,
+			"path": self.path,
+			"questions": [e for d in sorted(self.directories) for e in self.questions(d)]
+		}
+		writeCacheFile(self.indexFile, json.dumps(index))
+
+	############################################################################
+	# List the files of storage; new or changed files get an entry without
+	# text, read when fetched
+	# returns True if index changed
+	############################################################################
+	def refresh(self):
+		with self.lock:
+			changed = False
+			self.prefixIndex = dict()
+			self.scanned = 0
+			self.parsed = 0
+			found, self.loose = self.storage.list()
+
+			for d in list(self.directories):
+				if d not in found:
+					del self.directories[d]
+					changed = True
+
+			for d, files in found.items():
+				old = self.directories.get(d, dict())
+				new = dict()
+				for name, mtime, size in files:
+					if not name.endswith(_QUESTION_EXTENSION):
+						continue
+					q_id = name[:-len(_QUESTION_EXTENSION)]
+					self.scanned += 1
+					entry = old.get(q_id)
+					if entry is None or entry["mtime"] != mtime or entry["size"] != size:
+						entry = {
+							"directory": d,
+							"prefix": questionPrefix(name),
+							"id": q_id,
+							"mtime": mtime,
+							"size": size
+						}
+						changed = True
+					new[q_id] = entry
+				if len(new) != len(old):
+					changed = True
+				self.directories[d] = new
+			return changed
+
+	# save index file with the questions fetched since it was saved, once at
+	# the end of a command instead of on each fetch (a pack is rewritten only
+	# by its own save)
+	def saveFetched(self):
+		if self.dirty:
+			QuestionBank.save(self)
+
+	############################################################################
+	# Read and parse the questions keys [(directory, id)] not read yet, in
+	# one call to the storage (kept in index by saveFetched)
+	# returns number of questions read
+	############################################################################
+	def fetch(self, keys):
+		with self.lock:
+			keys = [(d, q_id) for d, q_id in keys if q_id in self.directories.get(d, ()) and "statement" not in self.directories[d][q_id]]
+			if not keys:
+				return 0
+			texts = self.storage.get_many([(d, q_id + _QUESTION_EXTENSION) for d, q_id in keys])
+			for d, q_id in keys:
+				statement, alternatives, correct = parseQuestion(texts[(d, q_id + _QUESTION_EXTENSION)])
+				entry = dict(self.directories[d][q_id])
+				entry.update({"statement": statement, "alternatives": alternatives, "correct": correct})
+				self.directories[d][q_id] = entry
+			self.parsed += len(keys)
+			self.dirty = True
+		return len(keys)
+
+	def fetchAll(self):
+		return self.fetch([(d, q_id) for d in self.directories for q_id in self.directories[d]])
+
+	############################################################################
+	# Queries
+	############################################################################
+	def hasDirectory(self, d):
+		return d in self.directories
+
+	# entries of directory d whose id starts with prefix, sorted by id
+	def questions(self, d, prefix=""):
+		entries = self.directories.get(d, dict())
+		return [entries[q] for q in sorted(entries) if q.startswith(prefix)]
+
+	def get(self, d, q_id):
+		entry = self.directories[d][q_id]
+		if "statement" not in entry:
+			self.fetch([(d, q_id)])
+			entry = self.directories[d][q_id]
+		return entry
+
+	# prefix -> sorted ids of questions of directory d (files without prefix
+	# are not counted); count of a prefix is the length of its list
+	def prefixes(self, d):
+		index = self.prefixIndex.get(d)
+		if index is None:
+			index = dict()
+			entries = self.directories.get(d, dict())
+			for q_id in sorted(entries):
+				if entries[q_id]["prefix"]:
+					index.setdefault(entries[q_id]["prefix"], []).append(q_id)
+			self.prefixIndex[d] = index
+		return index
+
+	# new bank (not persisted) only with questions keys [(directory, id)]
+	def subset(self, keys):
+		self.fetch(keys)
+		bank = QuestionBank(self.path, storage=self.storage)
+		for d, q_id in keys:
+			bank.directories.setdefault(d, dict())[q_id] = self.get(d, q_id)
+		return bank
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state["lock"]
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.lock = threading.Lock()
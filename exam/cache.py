@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/cache.py
+"""Content-addressed cache of generated exam files."""
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+
+_MEGABYTE = 1024 * 1024
+
+
+############################################################################
+# Key of the contents of parts (strings or bytes)
+############################################################################
+def contentKey(parts):
+	h = hashlib.sha1()
+	for part in parts:
+		if isinstance(part, str):
+			part = part.encode("utf-8")
+		h.update(hashlib.sha1(part).digest())
+	return h.hexdigest()
+
+############################################################################
+# Cache of files by key, least recently used entries removed when the
+# cache is bigger than maxSize (megabytes)
+############################################################################
+class BuildCache:
+
+	def __init__(self, path, maxSize=500):
+		self.path = path
+		self.maxSize = maxSize * _MEGABYTE
+
+	def entryPath(self, key):
+		return self.path + key[:2] + "/" + key + "/"
+
+	def has(self, key):
+		return os.path.isdir(self.entryPath(key))
+
+	############################################################################
+	# Copy files of entry key to folder destination, returns names copied
+	# or None if key is not in cache
+	############################################################################
+	def restore(self, key, destination):
+		entry = self.entryPath(key)
+		try:
+			names = os.listdir(entry)
+			for f in names:
+				shutil.copy2(entry + f, destination)
+			# entry mtime is its last use
+			os.utime(entry)
+		except OSError:
+			return None
+		return names
+
+	############################################################################
+	# Store files (with path) in entry key
+	############################################################################
+	def store(self, key, files):
+		entry = self.entryPath(key)
+		temp = None
+		try:
+			# folder unique to process and thread, renamed to entry
+			os.makedirs(os.path.dirname(entry[:-1]), exist_ok=True)
+			temp = tempfile.mkdtemp(dir=os.path.dirname(entry[:-1]), prefix=key + ".", suffix=".tmp") + "/"
+			for f in files:
+				shutil.copy2(f, temp)
+			if os.path.isdir(entry):
+				shutil.rmtree(entry)
+			os.replace(temp, entry)
+		except OSError:
+			# cache is optional, never fails a build
+			if temp is not None:
+				shutil.rmtree(temp, ignore_errors=True)
+			return
+		self.evict()
+
+	############################################################################
+	# Remove least recently used entries until cache fits maxSize
+	############################################################################
+	def evict(self):
+		entries = []
+		total = 0
+		for d in os.listdir(self.path):
+			if not os.path.isdir(self.path + d):
+				continue
+			for key in os.listdir(self.path + d):
+				if key.endswith(".tmp"):
+					# entry being stored
+					continue
+				entry = self.path + d + "/" + key + "/"
+				try:
+					size = sum(os.path.getsize(entry + f) for f in os.listdir(entry))
+					entries.append((os.path.getmtime(entry), size, entry))
+				except OSError:
+					continue
+				total += size
+		entries.sort()
+		for mtime, size, entry in entries:
+			if total <= self.maxSize:
+				break
+			shutil.rmtree(entry, ignore_errors=True)
+			total -= size
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/catalog.py
+"""Catalog of questions in SQLite: metadata and use of each question.
+
+Metadata is read from comments at the start of a question file:
+
+    % tags: jsp, servlets
+    % difficulty: 2
+    % author: Razer
+
+and kept with the restriction group of the question (config.yaml). Exams
+generated are recorded, so queries can leave out questions used by the
+last exams. Queries of exam files (queries session) run on indexes
+instead of scanning the question folders.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+	directory TEXT NOT NULL,
+	id TEXT NOT NULL,
+	prefix TEXT,
+	difficulty INTEGER,
+	author TEXT,
+	restriction INTEGER,
+	mtime REAL NOT NULL,
+	size INTEGER NOT NULL,
+	PRIMARY KEY (directory, id));
+CREATE INDEX IF NOT EXISTS questions_id ON questions (id);
+CREATE INDEX IF NOT EXISTS questions_prefix ON questions (directory, prefix);
+CREATE INDEX IF NOT EXISTS questions_difficulty ON questions (difficulty);
+CREATE INDEX IF NOT EXISTS questions_author ON questions (author);
+CREATE TABLE IF NOT EXISTS tags (
+	tag TEXT NOT NULL,
+	directory TEXT NOT NULL,
+	id TEXT NOT NULL,
+	PRIMARY KEY (tag, directory, id));
+CREATE INDEX IF NOT EXISTS tags_question ON tags (directory, id);
+CREATE TABLE IF NOT EXISTS exams (
+	exam TEXT PRIMARY KEY,
+	seq INTEGER NOT NULL,
+	date TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS usage (
+	exam TEXT NOT NULL,
+	directory TEXT NOT NULL,
+	id TEXT NOT NULL,
+	PRIMARY KEY (exam, directory, id));
+CREATE INDEX IF NOT EXISTS usage_question ON usage (directory, id);
+CREATE TABLE IF NOT EXISTS settings (
+	key TEXT PRIMARY KEY,
+	value TEXT NOT NULL);
+"""
+
+_METADATA_REGEX = re.compile(r"%\s*(tags|difficulty|author)\s*:\s*(.*?)\s*$")
+_DIFFICULTY_REGEX = r"\s*(>=|<=|>|<|=)?\s*(-?[0-9]+)\s*"
+_QUERY_KEYS = ("count", "directory", "prefix", "tags", "difficulty", "author", "not_used_in")
+
+
+############################################################################
+# Metadata of a question from the comments at the start of its text
+# (statement): tags (list, lowercase), difficulty (int or None), author
+############################################################################
+def parseMetadata(text):
+	metadata = {"tags": [], "difficulty": None, "author": None}
+	for line in text.splitlines():
+		line = line.strip()
+		if not line:
+			continue
+		if not line.startswith("%"):
+			break
+		m = _METADATA_REGEX.match(line)
+		if m is None:
+			continue
+		key, value = m.groups()
+		if key == "tags":
+			metadata["tags"] = sorted({t.strip().lower() for t in value.split(",") if t.strip()})
+		elif key == "difficulty":
+			metadata["difficulty"] = int(value) if re.fullmatch(r"-?[0-9]+", value) else None
+		else:
+			metadata["author"] = value or None
+	return metadata
+
+############################################################################
+# Catalog database (one for each question bank, in the cache folder)
+############################################################################
+class Catalog:
+
+	def __init__(self, filename):
+		self.filename = filename
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+		self.connection = sqlite3.connect(filename)
+		self.connection.executescript(_SCHEMA)
+
+	def close(self):
+		self.connection.close()
+
+	############################################################################
+	# Update the catalog with the questions of bank: metadata of new or changed
+	# questions (read in one fetch), and restriction groups (restrictions
+	# of config.yaml, lists of question ids), rewritten only when they
+	# change. returns questions updated
+	############################################################################
+	def sync(self, bank, restrictions=None):
+		known = {(d, q_id): (mtime, size) for d, q_id, mtime, size in self.connection.execute("SELECT directory, id, mtime, size FROM questions")}
+		current = set()
+		changed = []
+		for d in bank.directories:
+			for q_id, entry in bank.directories[d].items():
+				current.add((d, q_id))
+				if known.get((d, q_id)) != (entry["mtime"], entry["size"]):
+					changed.append((d, q_id))
+		removed = [key for key in known if key not in current]
+
+		group = dict()
+		for i, restriction in enumerate(restrictions or []):
+			for q_id in restriction:
+				group.setdefault(q_id, i+1)
+		groupsKey = hashlib.sha1(json.dumps(restrictions or [], sort_keys=True).encode("utf-8")).hexdigest()
+		stored = self.connection.execute("SELECT value FROM settings WHERE key = 'restrictions'").fetchone()
+
+		bank.fetch(changed)
+		with self.connection:
+			self.connection.executemany("DELETE FROM questions WHERE directory = ? AND id = ?", removed + changed)
+			self.connection.executemany("DELETE FROM tags WHERE directory = ? AND id = ?", removed + changed)
+			rows = []
+			tags = []
+			for d, q_id in changed:
+				entry = bank.get(d, q_id)
+				metadata = parseMetadata(entry["statement"])
+				rows.append((d, q_id, entry["prefix"], metadata["difficulty"], metadata["author"], group.get(q_id), entry["mtime"], entry["size"]))
+				tags += [(tag, d, q_id) for tag in metadata["tags"]]
+			self.connection.executemany("INSERT INTO questions (directory, id, prefix, difficulty, author, restriction, mtime, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+			self.connection.executemany("INSERT INTO tags (tag, directory, id) VALUES (?, ?, ?)", tags)
+
+			# restrictions can change without question files changing
+			if stored is None or stored[0] != groupsKey:
+				self.connection.execute("UPDATE questions SET restriction = NULL WHERE restriction IS NOT NULL")
+				self.connection.executemany("UPDATE questions SET restriction = ? WHERE id = ?", [(g, q_id) for q_id, g in group.items()])
+				self.connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('restrictions', ?)", (groupsKey,))
+		return len(changed) + len(removed)
+
+	############################################################################
+	# Questions [directory, prefix, id] matching query (dict of the queries
+	# session of an exam file); exam is left out of not_used_in
+	# raises ValueError for an invalid query
+	############################################################################
+	def select(self, query, exam=None):
+		for key in query:
+			if key not in _QUERY_KEYS:
+				raise ValueError("unknown key {} (use {})".format(key, ", ".join(_QUERY_KEYS)))
+		# files without prefix (not <prefix>_qNNNN) are not used
+		where = ["q.prefix IS NOT NULL"]
+		args = []
+		if query.get("directory"):
+			where.append("q.directory = ?")
+			args.append(query["directory"])
+		if query.get("prefix"):
+			where.append("q.prefix = ?")
+			args.append(query["prefix"])
+		if query.get("author"):
+			where.append("q.author = ?")
+			args.append(query["author"])
+		if query.get("difficulty") is not None:
+			m = re.fullmatch(_DIFFICULTY_REGEX, str(query["difficulty"]))
+			if m is None:
+				raise ValueError("difficulty {} is not a number or a comparison like >= 2".format(query["difficulty"]))
+			where.append("q.difficulty {} ?".format(m.group(1) or "="))
+			args.append(int(m.group(2)))
+		tags = query.get("tags") or []
+		if isinstance(tags, str):
+			tags = [tags]
+		for tag in tags:
+			where.append("EXISTS (SELECT 1 FROM tags t WHERE t.tag = ? AND t.directory = q.directory AND t.id = q.id)")
+			args.append(str(tag).lower())
+		if query.get("not_used_in"):
+			where.append("NOT EXISTS (SELECT 1 FROM usage u WHERE u.directory = q.directory AND u.id = q.id AND u.exam IN "
+				"(SELECT exam FROM exams WHERE exam != ? ORDER BY seq DESC LIMIT ?))")
+			args += [exam or "", int(query["not_used_in"])]
+
+		sql = "SELECT q.directory, q.prefix, q.id FROM questions q WHERE " + " AND ".join(where) + " ORDER BY q.directory, q.id"
+		return [list(row) for row in self.connection.execute(sql, args)]
+
+	############################################################################
+	# Record questions (keys [(directory, id)]) used by exam, replacing its
+	# previous generation
+	############################################################################
+	def recordUsage(self, exam, keys):
+		with self.connection:
+			self.connection.execute("DELETE FROM usage WHERE exam = ?", (exam,))
+			self.connection.executemany("INSERT OR IGNORE INTO usage (exam, directory, id) VALUES (?, ?, ?)", [(exam, d, q_id) for d, q_id in keys])
+			self.connection.execute("INSERT OR REPLACE INTO exams (exam, seq, date) VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM exams), ?)",
+				(exam, time.strftime("%Y-%m-%d %H:%M:%S")))
+
+	############################################################################
+	# Summary: number of questions, by difficulty, by tag and last exams
+	############################################################################
+	def summary(self, exams=5):
+		execute = self.connection.execute
+		return {
+			"questions": execute("SELECT COUNT(*) FROM questions").fetchone()[0],
+			"difficulty": execute("SELECT difficulty, COUNT(*) FROM questions GROUP BY difficulty ORDER BY difficulty").fetchall(),
+			"tags": execute("SELECT tag, COUNT(*) FROM tags GROUP BY tag ORDER BY COUNT(*) DESC, tag").fetchall(),
+			"exams": execute("SELECT e.exam, e.date, COUNT(u.id) FROM exams e LEFT JOIN usage u ON u.exam = e.exam GROUP BY e.exam ORDER BY e.seq DESC LIMIT ?", (exams,)).fetchall()
+		}
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/check.py
+"""Validation of question files, results cached by file mtime."""
+
+import os
+import re
+
+from .bank import parseQuestion, _ALTERNATIVES_SESSION, _CORRECT_MARK, _ALTERNATIVES_SEPARATOR, _QUESTION_REGEX
+from .catalog import parseMetadata
+from .files import writeCacheFile
+
+
+_CACHE_VERSION = 2
+_MAX_ALTERNATIVES = 26      # letters A-Z
+_INLINE_FILES = 32          # fewer changed files are checked without a pool
+
+# levels of issues
+ERROR = "error"
+WARNING = "warning"
+
+
+############################################################################
+# Issues of the text of a question: list of [level, message]
+############################################################################
+def checkText(text):
+	issues = []
+	statement, alternatives, correct = parseQuestion(text)
+	if not statement:
+		issues.append([ERROR, "empty statement"])
+	if text.find(_ALTERNATIVES_SESSION) < 0:
+		issues.append([ERROR, "missing {} session".format(_ALTERNATIVES_SESSION)])
+		return issues
+	if len(alternatives) < 2:
+		issues.append([ERROR, "less than 2 alternatives (separate them with {})".format(_ALTERNATIVES_SEPARATOR)])
+	if len(alternatives) > _MAX_ALTERNATIVES:
+		issues.append([ERROR, "{} alternatives, at most {}".format(len(alternatives), _MAX_ALTERNATIVES)])
+	if correct is None:
+		issues.append([ERROR, "no correct alternative (mark it with {})".format(_CORRECT_MARK)])
+	else:
+		marked = sum(1 for a in text[text.find(_ALTERNATIVES_SESSION):].split(_ALTERNATIVES_SEPARATOR) if a.strip().startswith(_CORRECT_MARK))
+		if marked > 1:
+			issues.append([WARNING, "{} alternatives marked as correct, only the first is used".format(marked)])
+	for i, a in enumerate(alternatives):
+		if not a:
+			issues.append([WARNING, "alternative {} is empty".format(i+1)])
+	if re.search(r"^\s*%\s*difficulty\s*:", statement, re.MULTILINE) and parseMetadata(statement)["difficulty"] is None:
+		issues.append([WARNING, "difficulty is not a number"])
+	return issues
+
+############################################################################
+# Issues of question file filename
+############################################################################
+def checkFile(filename):
+	try:
+		with open(filename, "r", encoding="utf-8") as f:
+			text = f.read()
+	except UnicodeDecodeError:
+		return checkName(filename) + [[ERROR, "file is not UTF-8"]]
+	except OSError as e:
+		return checkName(filename) + [[ERROR, "can not read file: {}".format(e.strerror)]]
+	return checkSource(filename, text)
+
+# issues of question filename with text (read from any storage)
+def checkSource(filename, text):
+	return checkName(filename) + checkText(text)
+
+def checkName(filename):
+	if not re.fullmatch(_QUESTION_REGEX, os.path.basename(filename)):
+		return [[WARNING, "name is not <prefix>_qNNNN.tex, question is not used"]]
+	return []
+
+############################################################################
+# Check files (list of paths) in a pool of processes, only files changed
+# since the last check (results kept in cacheFile)
+# returns filename -> issues, and number of files checked now
+############################################################################
+def checkFiles(files, cacheFile=None, workers=None):
+	import json
+	cache = dict()
+	if cacheFile is not None and os.path.exists(cacheFile):
+		try:
+			with open(cacheFile, "r", encoding="utf-8") as f:
+				data = json.load(f)
+			if data.get("version") == _CACHE_VERSION:
+				cache = data["files"]
+		except (OSError, ValueError):
+			pass
+
+	results = dict()
+	changed = []
+	stats = dict()
+	for filename in files:
+		st = os.stat(filename)
+		stats[filename] = [st.st_mtime, st.st_size]
+		cached = cache.get(filename)
+		if cached is not None and cached["stat"] == stats[filename]:
+			results[filename] = cached["issues"]
+		else:
+			changed.append(filename)
+
+	if len(changed) <= _INLINE_FILES:
+		checked = [checkFile(f) for f in changed]
+	else:
+		import concurrent.futures
+		with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+			checked = list(executor.map(checkFile, changed, chunksize=64))
+	results.update(zip(changed, checked))
+
+	if cacheFile is not None and changed:
+		data = {"version": _CACHE_VERSION, "files": {f: {"stat": stats[f], "issues": results[f]} for f in files}}
+		writeCacheFile(cacheFile, json.dumps(data))
+	return results, len(changed)
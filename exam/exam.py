@@ -4,27 +4,29 @@
 """EXAM entry point script."""
 
 import typer
-import fnmatch
 import os
 import io 
 import re
 import random
-import configparser
 import sys
-import getopt
-import operator
-import time
 import shutil
-import glob
-import subprocess
-from random import randint
-import yaml
-import gettext
-from pprint import pprint
-from distutils.spawn import find_executable
+import copy
+from typing import List
 
+# heavier modules (yaml, gettext, json, hashlib, concurrent.futures, pprint)
+# are imported by the functions that use them, to keep startup fast
 
 from .version import __app_name__, __version__
+from .bank import QuestionBank
+from .pack import PackedBank
+from .latex import compileDocuments, preambleFormat, FAILED, SKIPPED
+from .cache import BuildCache, contentKey
+from .profiler import Profiler
+from .files import writeFile
+from .sampler import selectQuestions, SelectionError, _NO_CONFLICTS
+from .render import renderFile, escapeLatex
+from .assets import AssetStore
+from .storage import openStorage, storageKind, DirectoryStorage
 
 __DEBUG = True 
 __NAME = "EXAM" 
@@ -48,13 +50,13 @@ _TEXT_EXTENSION = ".txt"
 _DIR_TEMPLATE = "template/"
 # files to copy
 _FILES_TEMPLATE_GENERAL = [ "exam.cls", "logo.png", "instructions.tex" ]
+# files <name><extension> of an exam kept in build cache (document, build)
+_BUILD_EXTENSIONS = (".tex", ".pdf", ".aux", ".build")
 # files to copy and substitute [[NAME]] with exam name
 _FILES_TEMPLATE = [ "exam_model.tex", "exam_model_result.tex" ]
 _HEADER_FILE = "header_model.tex"
 
 
-_ALTERNATIVES_SESSION = "[alternatives]"
-
 _QUESTION_SPACE 	= "0.3cm"
 _ALTERNATIVE_SPACE 	= "0.2cm"
 
@@ -78,48 +80,130 @@ _COMMAND_LATEX 		= "latex"
 _ANSWER_SHEET_FILE_SUFFIX		= "_answer_sheet.tex"
 _QUESTIONS_FILE_SUFFIX	= "_questions.tex"
 _ANSWERS_FILE_SUFFIX = "_answers.txt"
+_KEY_FILE_SUFFIX = "_key.json"
 _ANSWERS_HORIZ_FILE_SUFFIX = "_horiz_answers.txt"
+_ROSTER_FILE_SUFFIX = "_roster.csv"
+_MANIFEST_FILE_SUFFIX = "_manifest.json"
+_MANIFEST_VERSION = 1
+_MERGED_SUFFIX = "_all"
+
+# variants of an exam: <name>_vNNN
+_VARIANT_SUFFIX = "_v{:03d}"
+_VARIANT_REGEX = r"_v[0-9]{3,}"
+
+# merged document of all variants: page of each variant marked by labels
+_BEGIN_DOCUMENT = "\\begin{document}"
+_END_DOCUMENT = "\\end{document}"
+_PAGE_LABEL = "examvariant:{}:{}"
+_PAGE_LABEL_REGEX = r"\\newlabel\{examvariant:(first|last):([^}]*)\}\{\{.*?\}\{(\d+)\}"
 
 
 # constants
 _HEADER_SUFFIX 	= "_header.tex"
+_SEED_RANGE = 2**32
 
 class Config:
-	configuration = dict()
-	CONFIG_FILE = "config.yaml"
-	CWD = ""
-	PATH_TEMPLATE = ""
-	PATH_SCRIPT = ""
-	PATH_QUESTIONS = ""
+
+	def __init__(self):
+		self.configuration = dict()
+		self.CONFIG_FILE = "config.yaml"
+		self.CWD = ""
+		self.PATH_TEMPLATE = ""
+		self.PATH_SCRIPT = ""
+		self.PATH_QUESTIONS = ""
+		self.PATH_CACHE = ""
+		self.LOCALE = ""
+		self.conflicts = dict()   # restrictions: question -> set of conflicting questions
 
 class Exam:
-	examConfig = dict() 
-	allQuestions = []
-	quantities = []
-	countExamQuestions = 0
-	questionValue = 0
-	questions = []   		# name of questions, shuffle
-	correctAnswers = []  	# correct answers to each question
- 
-	EXAM_CONFIG_FILENAME = ""
-	EXAM_CONFIG_FILE = ""
-	EXAM_NAME = ""
-	EXAM_PATH = ""
-
-	ANSWER_FILE = ""           # only filename
-	ANSWER_FILENAME = ""       # path and filename
-	ANSWER_SHEET_FILENAME = ""
-	ANSWER_SHEET_FILE = ""
-	ANSWERS_FILENAME = ""
-	ANSWERS_FILE = ""
-	ANSWERS_HORIZ_FILENAME = ""
-	ANSWERS_HORIZ_FILE = ""
-	EXAM_FILENAME = ""         # only filename
-	EXAM_FILE = ""             # path and filename
-	EXAM_HEADER_FILENAME = ""  # only filename
-	EXAM_HEADER_FILE = ""      # path and filename
-	QUESTIONS_FILENAME = ""    # only filename
-	QUESTIONS_FILE = ""        # path and filename
+
+	def __init__(self, config, name, bank=None):
+		self.config = config
+		self.examConfig = dict() 
+		self.allQuestions = []
+		self.quantities = []
+		self.labels = []                # name of each group of allQuestions (directory/prefix or query)
+		self.countExamQuestions = 0
+		self.questionValue = 0
+		self.questions = []   		# name of questions, shuffle
+		self.correctAnswers = []  	# correct answers to each question
+		self.alternatives = []          # order of alternatives of each question (indexes in question file)
+		# question bank index, can be shared between exams (loaded on demand)
+		self.bank = bank
+		self.seed = None                # seed of random generator (--seed, exam: seed or random)
+		self.seedGiven = False          # seed given by user, exam can be cached
+		self.rng = None                 # random generator of exam, from seed
+		self.buildKey = None            # key of exam files in build cache
+		self.buildCached = False        # exam files restored from build cache
+		self.profiler = Profiler()      # disabled unless --profile
+		self.fields = dict()            # extra template fields (student name, id, ...)
+		self.roster = []                # students [id, name], one variant each (--roster)
+		self.student = None             # student [id, name] of variant
+	 
+		self.EXAM_CONFIG_FILENAME = ""
+		self.EXAM_CONFIG_FILE = ""
+		self.EXAM_NAME = ""
+		self.EXAM_PATH = ""
+		self.EXAM_PREFIX = ""           # prefix of generated files (exam name or variant name)
+
+		self.ANSWER_FILE = ""           # only filename
+		self.ANSWER_FILENAME = ""       # path and filename
+		self.ANSWER_SHEET_FILENAME = ""
+		self.ANSWER_SHEET_FILE = ""
+		self.ANSWERS_FILENAME = ""
+		self.ANSWERS_FILE = ""
+		self.ANSWERS_HORIZ_FILENAME = ""
+		self.ANSWERS_HORIZ_FILE = ""
+		self.EXAM_FILENAME = ""         # only filename
+		self.EXAM_FILE = ""             # path and filename
+		self.EXAM_HEADER_FILENAME = ""  # only filename
+		self.EXAM_HEADER_FILE = ""      # path and filename
+		self.QUESTIONS_FILENAME = ""    # only filename
+		self.QUESTIONS_FILE = ""        # path and filename
+
+		defineGlobals(self, name)
+
+	# copy of this exam to generate the variant name, sharing loaded questions
+	def variant(self, name):
+		v = copy.copy(self)
+		v.allQuestions = [list(questions) for questions in self.allQuestions]
+		v.questions = []
+		v.correctAnswers = []
+		v.alternatives = []
+		v.seed = "{}:{}".format(self.seed, name)
+		v.rng = random.Random(v.seed)
+		v.buildKey = None
+		v.buildCached = False
+		v.profiler = Profiler(self.profiler.enabled)
+		v.fields = dict(self.fields)
+		defineFileNames(v, name)
+		return v
+
+############################################################################
+# Builds exams reusing configuration and loaded questions (library API)
+############################################################################
+class ExamBuilder:
+
+	def __init__(self, config=None):
+		self.config = config if config is not None else loadConfig()
+		self.bank = loadBank(self.config)
+
+	def exam(self, name, examConfig=None):
+		exam = Exam(self.config, name, self.bank)
+		exam.examConfig = examConfig if examConfig is not None else loadExamConfig(exam)
+		return exam
+
+	# generate exam files (without PDF) and return the generated artifacts
+	def build(self, name, examConfig=None, variants=1, seed=None):
+		if self.bank.refresh():
+			self.bank.save()
+		exam = self.exam(name, examConfig)
+		exam.seed = seed
+		cleanFiles(exam)
+		copyInitFiles(exam, overwrite=True)
+		if variants <= 1:
+			copyTemplateFiles(exam)
+		return generateExam(exam, variants)
 
 
 ############################################################################
@@ -154,9 +238,9 @@ def usage(s=""):
 ############################################################################
 # 
 ############################################################################
-def getRandom():
+def newSeed():
 	key_num = random.SystemRandom()
-	return key_num.random()
+	return key_num.randrange(_SEED_RANGE)
 
 ############################################################################
 # Helper : log a string with level l (spaces)
@@ -172,7 +256,7 @@ def _DEBUG(s, l):
 		print((" " * (l*3)) + s)
   
 def letter(n):
-    if n<0 or n>4:
+    if n<0 or n>25:
         log(_("Error translating number to letter - answer: {}").format(n))
         sys.exit(1)
     return chr(65 + n)
@@ -225,36 +309,49 @@ def errorCommand(string):
 ############################################################################
 # Loads the configuration file
 ############################################################################
-def loadConfig():
-    
-	Config.CWD = slash(os.getcwd())
-	Config.PATH_SCRIPT = slash(os.path.dirname(os.path.realpath(__file__)))
-	if os.path.exists(Config.CWD + Config.CONFIG_FILE):
-		Config.CONFIG_FILE = Config.CWD + Config.CONFIG_FILE
+def loadConfig(cwd=None):
+	import yaml
+	import gettext
+
+	config = Config()
+	config.CWD = slash(cwd if cwd is not None else os.getcwd())
+	config.PATH_SCRIPT = slash(os.path.dirname(os.path.realpath(__file__)))
+	if os.environ.get("EXAM_CONFIG"):
+		config.CONFIG_FILE = os.path.expanduser(os.environ["EXAM_CONFIG"])
+	elif os.path.exists(config.CWD + config.CONFIG_FILE):
+		config.CONFIG_FILE = config.CWD + config.CONFIG_FILE
 	else:
-		Config.CONFIG_FILE = Config.PATH_SCRIPT + Config.CONFIG_FILE
-	with open(Config.CONFIG_FILE, 'r') as file:
+		config.CONFIG_FILE = config.PATH_SCRIPT + config.CONFIG_FILE
+	with open(config.CONFIG_FILE, 'r') as file:
 		my_config = yaml.safe_load(file)
   
-	Config.configuration = my_config
-	Config.PATH_TEMPLATE = slash(Config.PATH_SCRIPT + _DIR_TEMPLATE)
-	Config.PATH_QUESTIONS = slash(Config.PATH_SCRIPT + Config.configuration["config"]["questions"]["path"])
-	Config.LOCALE = Config.configuration["config"]["locale"]
+	config.configuration = my_config
+	config.PATH_TEMPLATE = slash(config.PATH_SCRIPT + _DIR_TEMPLATE)
+	# questions path relative to script folder, or absolute: a folder, an
+	# archive (.zip, .tar.gz) or a SQLite database (.sqlite)
+	config.PATH_QUESTIONS = os.path.join(config.PATH_SCRIPT, os.path.expanduser(config.configuration["config"]["questions"]["path"]))
+	if storageKind(config.PATH_QUESTIONS) == "directory":
+		config.PATH_QUESTIONS = slash(config.PATH_QUESTIONS)
+	config.PATH_CACHE = slash(os.path.expanduser(config.configuration["config"].get("cache", {}).get("path", "~/.cache/exam/")))
+	config.LOCALE = config.configuration["config"]["locale"]
+	config.conflicts = compileRestrictions(config.configuration["config"].get("restrictions"))
 	# internationalization
-	el = gettext.translation('base', localedir=Config.PATH_SCRIPT + 'locales', languages=[Config.LOCALE])
+	el = gettext.translation('base', localedir=config.PATH_SCRIPT + 'locales', languages=[config.LOCALE])
 	el.install()
 	# _ = el.gettext
+	return config
 
 
 ############################################################################
 # Loads exam file
 ############################################################################
-def loadExamConfig():
-    
-    if not os.path.exists(Exam.EXAM_CONFIG_FILE):
-        error(_("File {} does not exists.").format(Exam.EXAM_CONFIG_FILENAME))
+def loadExamConfig(exam):
+    import yaml
+
+    if not os.path.exists(exam.EXAM_CONFIG_FILE):
+        error(_("File {} does not exists.").format(exam.EXAM_CONFIG_FILENAME))
         
-    with open(Exam.EXAM_CONFIG_FILE, 'r') as file:
+    with open(exam.EXAM_CONFIG_FILE, 'r') as file:
         my_config = yaml.safe_load(file)
             
     return my_config
@@ -279,178 +376,203 @@ def prompt(question):
 ############################################################################
 # Define directories and global values
 ############################################################################
-def defineGlobals(exam):
+def defineGlobals(exam, name):
  
 
-	Exam.EXAM_NAME = removeSuffix(exam, _EXTENSION)
-	Exam.EXAM_PATH = slash(Config.CWD + Exam.EXAM_NAME)
+	exam.EXAM_NAME = removeSuffix(name, _EXTENSION)
+	exam.EXAM_PATH = slash(exam.config.CWD + exam.EXAM_NAME)
 	
 	# Set names and file names
-	Exam.EXAM_CONFIG_FILENAME = Exam.EXAM_NAME + _EXTENSION
-	Exam.EXAM_CONFIG_FILE = Config.CWD + Exam.EXAM_CONFIG_FILENAME
- 
-	Exam.ANSWER_SHEET_FILENAME = Exam.EXAM_NAME + _ANSWER_SHEET_FILE_SUFFIX
-	Exam.ANSWER_SHEET_FILE = Exam.EXAM_PATH + Exam.ANSWER_SHEET_FILENAME
+	exam.EXAM_CONFIG_FILENAME = exam.EXAM_NAME + _EXTENSION
+	exam.EXAM_CONFIG_FILE = exam.config.CWD + exam.EXAM_CONFIG_FILENAME
+
+	defineFileNames(exam, exam.EXAM_NAME)
+
+############################################################################
+# Define names of generated files with prefix (exam or variant name)
+############################################################################
+def defineFileNames(exam, prefix):
+
+	exam.EXAM_PREFIX = prefix
  
-	Exam.ANSWERS_FILENAME = Exam.EXAM_NAME + _ANSWERS_FILE_SUFFIX
-	Exam.ANSWERS_FILE = Exam.EXAM_PATH + Exam.ANSWERS_FILENAME
-	Exam.ANSWERS_HORIZ_FILENAME = Exam.EXAM_NAME + _ANSWERS_HORIZ_FILE_SUFFIX
-	Exam.ANSWERS_HORIZ_FILE = Exam.EXAM_PATH + Exam.ANSWERS_HORIZ_FILENAME
+	exam.ANSWER_SHEET_FILENAME = prefix + _ANSWER_SHEET_FILE_SUFFIX
+	exam.ANSWER_SHEET_FILE = exam.EXAM_PATH + exam.ANSWER_SHEET_FILENAME
  
-	Exam.EXAM_HEADER_FILENAME = Exam.EXAM_NAME + _HEADER_SUFFIX  
-	Exam.EXAM_HEADER_FILE = Exam.EXAM_PATH + Exam.EXAM_HEADER_FILENAME
+	exam.ANSWERS_FILENAME = prefix + _ANSWERS_FILE_SUFFIX
+	exam.ANSWERS_FILE = exam.EXAM_PATH + exam.ANSWERS_FILENAME
+	exam.ANSWERS_HORIZ_FILENAME = prefix + _ANSWERS_HORIZ_FILE_SUFFIX
+	exam.ANSWERS_HORIZ_FILE = exam.EXAM_PATH + exam.ANSWERS_HORIZ_FILENAME
  
-	Exam.EXAM_FILENAME = Exam.EXAM_NAME + _EXAM_EXTENSION
-	Exam.EXAM_FILE = Exam.EXAM_PATH + Exam.EXAM_FILENAME
+	exam.EXAM_HEADER_FILENAME = prefix + _HEADER_SUFFIX  
+	exam.EXAM_HEADER_FILE = exam.EXAM_PATH + exam.EXAM_HEADER_FILENAME
  
-	Exam.QUESTIONS_FILENAME = Exam.EXAM_NAME + _QUESTIONS_FILE_SUFFIX
-	Exam.QUESTIONS_FILE = Exam.EXAM_PATH + Exam.QUESTIONS_FILENAME
-	
+	exam.EXAM_FILENAME = prefix + _EXAM_EXTENSION
+	exam.EXAM_FILE = exam.EXAM_PATH + exam.EXAM_FILENAME
  
+	exam.QUESTIONS_FILENAME = prefix + _QUESTIONS_FILE_SUFFIX
+	exam.QUESTIONS_FILE = exam.EXAM_PATH + exam.QUESTIONS_FILENAME
+
+############################################################################
+# Name of variant n (1..N) of exam
+############################################################################
+def variantName(name, n):
+	return name + _VARIANT_SUFFIX.format(n)
+
+############################################################################
+# List variants already generated in exam folder (sorted)
+############################################################################
+def listVariants(exam):
+	variants = []
+	if os.path.exists(exam.EXAM_PATH):
+		for f in os.listdir(exam.EXAM_PATH):
+			if re.fullmatch(re.escape(exam.EXAM_NAME) + _VARIANT_REGEX + re.escape(_EXAM_EXTENSION), f):
+				variants.append(removeSuffix(f, _EXAM_EXTENSION))
+	# by number: _v1000 after _v999
+	variants.sort(key=lambda v: (len(v), v))
+	return variants
  
 ############################################################################
 # Remove all temp and exam files
 ############################################################################
-def cleanFiles():
-    removeFile(Exam.QUESTIONS_FILENAME)
-    removeFile(Exam.ANSWER_FILE)
+def cleanFiles(exam):
+    removeFile(exam.QUESTIONS_FILENAME)
+    removeFile(exam.ANSWER_FILE)
      
 
 ############################################################################
 # 
 ############################################################################
-def copyInitFiles():
+def copyInitFiles(exam, overwrite=None):
 	try:  
 		# create folder to new exam
-		if not os.path.isdir(Exam.EXAM_NAME):
-			os.mkdir(Exam.EXAM_NAME)
+		if not os.path.isdir(exam.EXAM_PATH):
+			os.mkdir(exam.EXAM_PATH)
 		else:
-			res = prompt(_("Directory {} already exists. Can overwrite files?").format(Exam.EXAM_NAME))
+			# overwrite: None asks the user
+			res = overwrite
+			if res is None:
+				res = prompt(_("Directory {} already exists. Can overwrite files?").format(exam.EXAM_NAME))
 			if res:
 				log(_("Removing files..."), 1)
-				removeFilesFromDirectory(Exam.EXAM_PATH)
+				removeFilesFromDirectory(exam.EXAM_PATH)
 			else:
 				log(_("To make a new exam, files need to be overwritten. Try again."))
 				sys.exit(0)
 	except OSError:  
-		log (_("!!! Creation of the directory {} failed").format(Exam.EXAM_NAME))
+		log (_("!!! Creation of the directory {} failed").format(exam.EXAM_NAME))
 		sys.exit(1)
 
-	# Copy template files into exam folder
+	# Link (or copy) template files into exam folder from shared asset store
+	store = assetStore(exam.config)
 	for f in _FILES_TEMPLATE_GENERAL:
-		fn = Config.PATH_TEMPLATE + f
+		fn = exam.config.PATH_TEMPLATE + f
 		if not os.path.exists(fn):
 			log (_("!!! Template file {} does not exist").format(fn))
 			sys.exit(1)
-		log (_("Copying file {}...").format(f), 1)
-		shutil.copy(fn, Exam.EXAM_PATH)
+		how = store.stage(fn, exam.EXAM_PATH)
+		log (_("Staging file {} ({})...").format(f, how), 1)
 
-	# SED command to substitute template string [[NAME]] with the name of exam
-	sed_command = ["sed", "-e", "s/\[\[NAME\]\]/" + Exam.EXAM_NAME + "/g"]
-	
-	# Copy files, change name and execute SED to change [[NAME]]
+############################################################################
+# Fields of templates: [[NAME]], [[CLASS]], [[EXAM]], [[DATE]] and the extra
+# fields of exam ([[STUDENT]] and [[STUDENT_ID]] of a roster)
+############################################################################
+def templateFields(exam):
+	fields = {"NAME": exam.EXAM_PREFIX, "STUDENT": "", "STUDENT_ID": ""}
+	if "exam" in exam.examConfig:
+		fields["CLASS"] = exam.examConfig["exam"]["class"]
+		fields["EXAM"] = exam.examConfig["exam"]["name"]
+		fields["DATE"] = exam.examConfig["exam"]["date"]
+	fields.update(exam.fields)
+	return fields
+
+############################################################################
+# Copy template files of exam (or variant) substituting [[NAME]]
+############################################################################
+def copyTemplateFiles(exam):
+
+	fields = templateFields(exam)
 	for f in _FILES_TEMPLATE:
-		fn = Config.PATH_TEMPLATE + f
-		fout = Exam.EXAM_PATH + f.replace("exam_model", Exam.EXAM_NAME)
+		fn = exam.config.PATH_TEMPLATE + f
+		fout = exam.EXAM_PATH + f.replace("exam_model", exam.EXAM_PREFIX)
 
 		log (_("Copying file {}...").format(f), 1)
 		if not os.path.exists(fn):
 			log (_("!!! Template file {} does not exist").format(fn))
 			sys.exit(1)
-   
-		with open(fout, "w") as outfile:
-			# change [[NAME]] and write to outfile
-			subprocess.call(sed_command + [fn], stdout=outfile)
 
-    
+		writeFile(fout, renderFile(fn, fields))
 
 ############################################################################
 # 
 ############################################################################
-def generateHeaderFile():
-    
-	with io.open(Config.PATH_TEMPLATE + _HEADER_FILE, "r", encoding="utf-8") as f:
-		newText = f.read().replace("[[CLASS]]", Exam.examConfig["exam"]["class"])
-		newText = newText.replace("[[EXAM]]", Exam.examConfig["exam"]["name"])
-		newText = newText.replace("[[DATE]]", Exam.examConfig["exam"]["date"])
+def generateHeaderFile(exam):
 
-	with io.open(Exam.EXAM_HEADER_FILE, "w", encoding="utf-8") as f:
-		f.write(newText)
+	newText = renderFile(exam.config.PATH_TEMPLATE + _HEADER_FILE, templateFields(exam))
+	writeFile(exam.EXAM_HEADER_FILE, "% Seed: {}\n".format(exam.seed) + newText)
 
 ############################################################################
 # 
 ############################################################################
-def generateAnswerSheet():
+def generateAnswerSheet(exam):
 
-	str_ans = "\\renewcommand{\\arraystretch}{2}\n"
-	str_ans += "\\begin{tabular}{|c|c||c|c|}\n"
-	str_ans += "\\hline\n"
-	str_ans += " Questão & Resposta & Questão & Resposta\\\\\n"
-	str_ans += "\\hline\n"
-	lines = Exam.countExamQuestions // 2
+	str_ans = ["\\renewcommand{\\arraystretch}{2}\n",
+		"\\begin{tabular}{|c|c||c|c|}\n",
+		"\\hline\n",
+		" Questão & Resposta & Questão & Resposta\\\\\n",
+		"\\hline\n"]
+	lines = exam.countExamQuestions // 2
 	for i in range(1, lines+1):
-		str_ans += "\\hline\n"
-		str_ans += str(i) + " & & " + str(i+lines) + " & \\\\\n"
+		str_ans.append("\\hline\n")
+		str_ans.append(str(i) + " & & " + str(i+lines) + " & \\\\\n")
 		if i % 5 == 0:
-			str_ans += "\\hline\n"
-	str_ans += "\\hline\n"
-	str_ans += "\\end{tabular}\n"
+			str_ans.append("\\hline\n")
+	str_ans.append("\\hline\n")
+	str_ans.append("\\end{tabular}\n")
 
-	with open(Exam.ANSWER_SHEET_FILE, "a+") as exam_file:
-		exam_file.write(str_ans)
+	writeFile(exam.ANSWER_SHEET_FILE, str_ans)
 
 ############################################################################
 # 
 ############################################################################
-def hasRestriction(q_list, q):
-    
-    list_restrictions = Config.configuration["config"]["restrictions"]
-    for restriction in list_restrictions:
-        if q in restriction:
-            # question q is in a restrictions
-            # need to verify if one of the list already in q_list
-            for q_restriction in restriction:
-                if q_restriction in q_list:
-                    return True
-    return False
+def getRestrictions(config, q):
+	return sorted(config.conflicts.get(q, _NO_CONFLICTS))
 
 ############################################################################
-# 
+# Compile restrictions (lists of questions that can not be together in an
+# exam) in a map question -> set of conflicting questions
 ############################################################################
-def getRestrictions(q):
-    
-	list_res = []
-	list_restrictions = Config.configuration["config"]["restrictions"]
-	for restriction in list_restrictions:
-		if q in restriction:
-			for q_restriction in restriction:
-				if q_restriction!=q:
-					list_res.append(q_restriction)
-	return list_res
+def compileRestrictions(list_restrictions):
+	conflicts = dict()
+	for restriction in list_restrictions or []:
+		for q in restriction:
+			conflicts.setdefault(q, set()).update(restriction)
+	for q in conflicts:
+		conflicts[q].discard(q)
+	return conflicts
 
 ############################################################################
 # 
 ############################################################################
-def generateQuestions():
+def loadQuestions(exam):
 	# Loads all questions
 	count_questions = 0
-	Exam.quantities = []
+	exam.quantities = []
+	exam.labels = []
 	q_files_temp = []
-	for d in Exam.examConfig["questions"]:
+	bank = questionBank(exam)
+	questions = exam.examConfig.get("questions") or {}
+	for d in questions:
 		# d is a folder, like angular
-		temp = slash(Config.PATH_QUESTIONS + d)
-	
-		if not os.path.exists(temp):
-			error(_("Question path does not exists: {} ".format(temp)))
+		if not bank.hasDirectory(d):
+			error(_("Question path does not exists: {} ".format(slash(exam.config.PATH_QUESTIONS + d))))
    
-		for q in Exam.examConfig["questions"][d]:
+		for q in questions[d]:
 			# q is a question type (prefix), like angular_F
-			#print ("   " + q)
 			# loads many lists as questions types we have, maintain only question name (without extension)
-			# removed .lower() after removeSuffix
-			q_files_type = [[d, q, removeSuffix(arc, ".tex")] for arc in os.listdir(temp) if (os.path.isfile(os.path.join(temp, arc)) and arc.startswith(q))]
+			q_files_type = [[d, q, entry["id"]] for entry in bank.questions(d, q)]
 			q_files_temp.append(q_files_type)
-			c = Exam.examConfig["questions"][d][q]
+			exam.labels.append(d + "/" + q)
+			c = questions[d][q]
 			if (c == "*"):
 				quant = len(q_files_type)
 			else:
@@ -459,209 +581,640 @@ def generateQuestions():
 				else:
 					quant = c
 			count_questions += quant
-			Exam.quantities.append(quant)
+			exam.quantities.append(quant)
    
 			log(_("Question type : {}").format(q), 1)
 			log(_("Questions in database : {}").format(str(len(q_files_type))), 2)
 			log(_("Questions in exam     : {}").format(str(c)), 2)
-     
-	Exam.allQuestions = q_files_temp
-	Exam.countExamQuestions = count_questions
- 
-	log(_("Generating {} questions...").format(str(Exam.countExamQuestions)), 1)
 
-	generateAnswerSheet()
+	# queries of catalog (tags, difficulty, ...), each one a group of questions
+	queries = exam.examConfig.get("queries") or []
+	if queries:
+		catalog = questionCatalog(exam.config, questionBank(exam), exam.profiler)
+		for i, query in enumerate(queries):
+			label = _("query {}").format(i+1)
+			if not isinstance(query, dict) or "count" not in query:
+				error(_("Query {} of exam file needs count.").format(i+1))
+			try:
+				q_files_type = [[d, prefix, q_id] for d, prefix, q_id in catalog.select(query, exam.EXAM_NAME)]
+			except ValueError as e:
+				error(_("Query {} of exam file is invalid: {}").format(i+1, e))
+			c = query["count"]
+			quant = len(q_files_type) if c == "*" else c
+			if quant > len(q_files_type):
+				error(_("Too few questions in database to create exam: {} questions stored but {} questions solicited.").format(str(len(q_files_type)), str(c)))
+			q_files_temp.append(q_files_type)
+			exam.labels.append(label)
+			count_questions += quant
+			exam.quantities.append(quant)
+			log(_("Question query : {}").format(", ".join("{}={}".format(k, v) for k, v in query.items() if k != "count")), 1)
+			log(_("Questions in database : {}").format(str(len(q_files_type))), 2)
+			log(_("Questions in exam     : {}").format(str(c)), 2)
+		catalog.close()
+     
+	exam.allQuestions = q_files_temp
+	exam.countExamQuestions = count_questions
  
 	# calculate score of each question
 	int_value = True
-	if (Exam.examConfig["exam"]["total_score"] % Exam.countExamQuestions != 0):
+	if (exam.examConfig["exam"]["total_score"] % exam.countExamQuestions != 0):
 		int_value = False
-		Exam.questionValue = round( float(Exam.examConfig["exam"]["total_score"]) / Exam.countExamQuestions, 1)
-		#log("!!! ATTENTION: Value of questions is not integer: "+ str(Exam.examConfig["exam"]["total_score"]) + " / " + str(Exam.countExamQuestions) + " => " + str(Exam.questionValue), 1)
+		exam.questionValue = round( float(exam.examConfig["exam"]["total_score"]) / exam.countExamQuestions, 1)
+		#log("!!! ATTENTION: Value of questions is not integer: "+ str(exam.examConfig["exam"]["total_score"]) + " / " + str(exam.countExamQuestions) + " => " + str(exam.questionValue), 1)
 	else:
-		Exam.questionValue = Exam.examConfig["exam"]["total_score"] / Exam.countExamQuestions
+		exam.questionValue = exam.examConfig["exam"]["total_score"] / exam.countExamQuestions
+
+	log(_("Score of each question {}").format(exam.questionValue), 1)
+
+############################################################################
+# Loads the question bank index of configuration
+############################################################################
+def loadBank(config):
+	# pack file (exam pack) is used when it exists, else the JSON index
+	if os.path.exists(bankFile(config, "pack_", ".pack")):
+		return PackedBank(config.PATH_QUESTIONS, bankFile(config, "pack_", ".pack"), questionStorage(config)).load()
+	return QuestionBank(config.PATH_QUESTIONS, bankFile(config, "index_", ".json"), questionStorage(config)).load()
+
+# catalog of questions (metadata and use), updated with the question bank
+def questionCatalog(config, bank, profiler):
+	from .catalog import Catalog
+	catalog = Catalog(bankFile(config, "catalog_", ".sqlite"))
+	with profiler.stage("catalogSync"):
+		updated = catalog.sync(bank, config.configuration["config"].get("restrictions"))
+	profiler.count("catalog questions updated", updated)
+	return catalog
+
+# index of questions saved once with the questions fetched by a command
+def saveQuestionIndex(exam):
+	questionBank(exam).saveFetched()
+
+# storage of question files, read through a local copy if configured
+# (questions: cache: true, for slow storage)
+def questionStorage(config):
+	cache = None
+	if config.configuration["config"]["questions"].get("cache"):
+		cache = bankFile(config, "files_", "/")
+	return openStorage(config.PATH_QUESTIONS, cache)
+
+# file of question bank in cache folder, one for each questions path
+def bankFile(config, prefix, extension):
+	import hashlib
+	key = hashlib.sha1(config.PATH_QUESTIONS.encode("utf-8")).hexdigest()[:12]
+	return config.PATH_CACHE + prefix + key + extension
+
+def questionBank(exam):
+	if exam.bank is None:
+		with exam.profiler.stage("loadBank"):
+			exam.bank = loadBank(exam.config)
+		exam.profiler.count("files scanned", exam.bank.scanned)
+		exam.profiler.count("files parsed", exam.bank.parsed)
+	return exam.bank
+
+############################################################################
+# Pick questions of exam from loaded questions
+############################################################################
+def generateQuestions(exam):
+	log(_("Generating {} questions...").format(str(exam.countExamQuestions)), 1)
+
+	# pick questions of each type at random, no two restricted together
+	names = [[question for d_type, q_type, question in questions] for questions in exam.allQuestions]
+	stats = dict()
+	try:
+		selection = selectQuestions(exam.rng, names, exam.quantities, exam.config.conflicts, exam.labels, stats)
+	except SelectionError as e:
+		for line in e.blocking:
+			log(line, 2)
+		error(_("Insufficient questions to make this exam. Need {} questions: {}.").format(exam.countExamQuestions, e))
+	finally:
+		exam.profiler.count("restriction checks", stats.get("checks", 0))
+		exam.profiler.count("selection samples", stats.get("samples", 0))
+		exam.profiler.count("selection search steps", stats.get("steps", 0))
+
+	exam.questions = []
+	for questions, chosen in zip(exam.allQuestions, selection):
+		items = {question: [d_type, q_type, question] for d_type, q_type, question in questions}
+		exam.questions += [items[question] for question in chosen]
+
+	# texts of the selected questions, read in one call to the storage
+	exam.profiler.count("questions fetched", questionBank(exam).fetch([(d_type, q_name) for d_type, q_type, q_name in exam.questions]))
 
-	log(_("Score of each question {}").format(Exam.questionValue), 1)
- 
-	# randomize all questions to choose
-	for questions in Exam.allQuestions:
-		random.seed(getRandom())
-		while True:
-			random.shuffle(questions)
-			if random.random() > 0.5:
-				break
-
-
-	# pick each question without restriction
-	Exam.questions = []
-	count = 0
-	for questions_type in Exam.allQuestions:
-		# quantity of that kind question
-  
-		quant = Exam.quantities[count]
-		count_questions = 0
-		for d_type, q_type, question in questions_type:
-			if not hasRestriction(Exam.questions, question):
-				# can add this question
-				Exam.questions.append([d_type, q_type, question])
-				count_questions += 1
-				if count_questions >= quant:
-					break
-
-		count += 1
-
-	#pprint(Exam.questions)
-	#pprint(len(Exam.questions))
- 
-	if (len(Exam.questions) < Exam.countExamQuestions):
-		error(_("Insufficient questions to make this exam. Need {} but only can choose {} with all restrictions.").format(+ str(Exam.countExamQuestions), str(len(Exam.questions))))
-  
 	# Randomize questions choosen
-	random.seed(getRandom())
-	while True:
-		random.shuffle(Exam.questions)
-		if random.random() > 0.5:
-			break
+	exam.rng.shuffle(exam.questions)
 
 
 ############################################################################
 # Generate correct answer to each question
 ############################################################################
-def generateCorrectAnswers():
+def generateCorrectAnswers(exam):
 	
-	Exam.correctAnswers = []
-    
-	while True:
-		random.seed(getRandom())
-		answers = random.choices([0, 1, 2, 3, 4], k=Exam.countExamQuestions)
-		count = [answers.count(0), answers.count(1), answers.count(2), answers.count(3), answers.count(4)]
-		min_a = min(count)
-		max_a = max(count)
-		if max_a-min_a <= Exam.examConfig["exam"]["balanced_questions"]:
-			# now we can accept answers
-			Exam.correctAnswers = answers
-			break
-		else:
-			# unbalanced number of correct ansers
-			answers = []
-	log(f"A={Exam.correctAnswers.count(0)}, B={Exam.correctAnswers.count(1)}, C={Exam.correctAnswers.count(2)}, D={Exam.correctAnswers.count(3)}, E={Exam.correctAnswers.count(4)}", 1)
-   
-    
+	bank = questionBank(exam)
+	alternatives = [len(bank.get(d_type, q_name)["alternatives"]) for d_type, q_type, q_name in exam.questions]
+	weights = None
+	if "answers_distribution" in exam.examConfig["exam"]:
+		# letter -> weight, like {A: 1, B: 1, C: 1, D: 1, E: 2}
+		distribution = exam.examConfig["exam"]["answers_distribution"]
+		weights = [distribution.get(letter(l), 0) for l in range(max(alternatives))]
+		if any(not isinstance(w, (int, float)) or w < 0 for w in weights) or sum(weights) == 0:
+			error(_("answers_distribution of exam file needs a positive weight for one of letters {}.").format(", ".join(letter(l) for l in range(max(alternatives)))))
+
+	stats = dict()
+	exam.correctAnswers = balancedAnswers(exam.rng, alternatives, exam.examConfig["exam"].get("balanced_questions", 0), weights, stats)
+	exam.profiler.count("answer moves rejected", stats["rejected"])
+	log(", ".join(f"{letter(l)}={exam.correctAnswers.count(l)}" for l in range(max(alternatives))), 1)
+
+############################################################################
+# Order of alternatives of each question: wrong ones at random, the correct
+# one at the position of its letter
+############################################################################
+def generateAlternatives(exam):
+
+	bank = questionBank(exam)
+	exam.alternatives = []
+	for (d_type, q_type, q_name), correct in zip(exam.questions, exam.correctAnswers):
+		entry = bank.get(d_type, q_name)
+		order = [i for i in range(len(entry["alternatives"])) if i != entry["correct"]]
+		exam.rng.shuffle(order)
+		order.insert(min(correct, len(order)), entry["correct"])
+		exam.alternatives.append(order)
+
+############################################################################
+# Correct answer (0 = A) of each question with alternatives[i] alternatives.
+# Number of answers of each letter is within tolerance of the target (from
+# weights of each letter, or the expected count of choosing at random).
+############################################################################
+def balancedAnswers(rng, alternatives, tolerance, weights=None, stats=None):
+
+	n = len(alternatives)
+	alternatives = [max(a, 1) for a in alternatives]
+	k = max(alternatives, default=1)
+
+	# target count of each letter
+	if weights is None:
+		targets = [0.0] * k
+		for a in alternatives:
+			for l in range(a):
+				targets[l] += 1.0 / a
+	else:
+		total = sum(weights)
+		targets = [float(n) * w / total for w in weights]
+
+	# counts rounded from targets (largest remainder, ties at random)
+	counts = [int(t) for t in targets]
+	rest = sorted(range(k), key=lambda l: (targets[l] - counts[l], rng.random()), reverse=True)
+	for l in rest[:n - sum(counts)]:
+		counts[l] += 1
+
+	def spread(c):
+		d = [c[l] - targets[l] for l in range(k) if targets[l] > 0]
+		return max(d) - min(d)
+
+	# random moves of answers between letters while within tolerance,
+	# so the number of answers of each letter is not predictable
+	limit = max(tolerance, spread(counts))
+	rejected = 0
+	for i in range(n):
+		a = rng.randrange(k)
+		b = rng.randrange(k)
+		if a == b or counts[a] == 0 or targets[b] == 0:
+			continue
+		counts[a] -= 1
+		counts[b] += 1
+		if spread(counts) > limit:
+			counts[a] += 1
+			counts[b] -= 1
+			rejected += 1
+	if stats is not None:
+		stats["rejected"] = rejected
+
+	# assign letters from the last one, to random questions that have it
+	# (a letter without enough questions passes the rest to the previous one)
+	answers = [0] * n
+	questions = sorted(range(n), key=lambda i: alternatives[i], reverse=True)
+	pool = []
+	next_q = 0
+	for l in range(k-1, -1, -1):
+		while next_q < n and alternatives[questions[next_q]] > l:
+			pool.append(questions[next_q])
+			next_q += 1
+		for c in range(counts[l]):
+			if not pool:
+				counts[l-1] += counts[l] - c
+				break
+			p = rng.randrange(len(pool))
+			pool[p], pool[-1] = pool[-1], pool[p]
+			answers[pool.pop()] = l
+	return answers
+
 ############################################################################
 # 
 ############################################################################
-def generateExamFile():
+def generateExamFile(exam):
+	writeFile(exam.QUESTIONS_FILE, examFileChunks(exam))
+
+############################################################################
+# Text of questions file, one chunk for each question
+############################################################################
+def examFileChunks(exam):
     
+	if isinstance(exam.questionValue, int):
+		str_question_score = str(exam.questionValue)
+	else:
+		str_question_score = "%.1f" % exam.questionValue
+		str_question_score = str_question_score.replace(".", ",")
+
+	yield "% Seed: {}\n".format(exam.seed)
+
+	bank = questionBank(exam)
 	count = 0
-	#log(f"Questions in exam: {len(Exam.questions)}", 1)
 	# d_type - folder, q_type - type (prefix of question name), q_name - full name of question
-	for d_type, q_type, q_name in Exam.questions:
-		# load question file
-		filename = slash(Config.PATH_QUESTIONS + d_type) + q_name + _QUESTION_EXTENSION
-		#pprint(filename)
-		with open(filename, "r") as question_file:
-			question_text = question_file.read() 
-		alts = question_text.find(_ALTERNATIVES_SESSION)
-  
-		q_statement = question_text[:alts].strip()
-		alts_str = question_text[alts+len(_ALTERNATIVES_SESSION):]
-		alts_arr = alts_str.split("//")
+	for d_type, q_type, q_name in exam.questions:
+		# load question from index
+		entry = bank.get(d_type, q_name)
+		q_statement = entry["statement"]
 		alts_final = []
-		for a in alts_arr:
-			if (a.strip().startswith("*")):
-				str_alt_right = "\\CorrectChoice " + a[2:].strip()
+		for i in exam.alternatives[count]:
+			if i == entry["correct"]:
+				alts_final.append("\\CorrectChoice " + entry["alternatives"][i])
 			else:
-				alts_final.append("\\choice " + a.strip())
-    
-		# randomize wrong answers
-		random.seed(getRandom())
-		while True:
-			random.shuffle(alts_final)
-			if random.random() > 0.5:
-				break
-
-	    # insert right answer in correct position
-		if Exam.correctAnswers[count] > len(alts_final):
-			alts_final.append(str_alt_right)
-		else:
-			alts_final.insert(Exam.correctAnswers[count], str_alt_right)
-		str_right_answer_letter = letter(Exam.correctAnswers[count])
-  
-		# save questions in exam file
-		#log(f"Writing questions {count} {Exam.QUESTIONS_FILENAME}.", 1)
-		with open(Exam.QUESTIONS_FILE, "a+") as exam_file:
-			exam_file.write("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%\n% " + q_name + " - Q" + str(count+1) + " - " + str_right_answer_letter + " \n")
-			exam_file.write("% Question: " + q_name + "\n")
-			exam_file.write("% Number:   " + str(count+1) + "\n")
-			exam_file.write("% Correct:  " + str_right_answer_letter + "\n")
-			exam_file.write("% Type:     " + q_type + "\n")
-			exam_file.write("% Path:     " + d_type + "/" + q_name + _EXAM_EXTENSION + "\n")
-			exam_file.write("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%\n")
-			exam_file.write("\\begin{minipage}{\linewidth}\n") 
-
-
-			if isinstance(Exam.questionValue, int):
-				str_question_score = str(Exam.questionValue)
-			else:
-				str_question_score = "%.1f" % Exam.questionValue
-				str_question_score = str_question_score.replace(".", ",")
-    
-			#### TODO - parei aqui, estou gerando o arquivo .tex da prova, para cada questao
+				alts_final.append("\\choice " + entry["alternatives"][i])
+		str_right_answer_letter = letter(exam.correctAnswers[count])
   
-			exam_file.write("\\question\n\n")	
-			exam_file.write("[" + str_question_score + "]\ ")	
-			exam_file.write(q_statement)
-			exam_file.write("\n\n")
-			if (_ALTERNATIVE_SPACE != ""):
-				exam_file.write("\\vspace{" + _ALTERNATIVE_SPACE + "}\n")
-			exam_file.write("\\begin{choices}\n")	
-			for c in alts_final:
-				exam_file.write(c)
-				exam_file.write("\n")
-			exam_file.write("\\end{choices}\n\n")	
-			exam_file.write("\\end{minipage}\n") 
-			if (_QUESTION_SPACE != ""):
-				exam_file.write("\\vspace{" + _QUESTION_SPACE + "}\n")
-			exam_file.write("\n\n")
+		# question in exam file
+		chunk = [
+			"%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%\n% " + q_name + " - Q" + str(count+1) + " - " + str_right_answer_letter + " \n",
+			"% Question: " + q_name + "\n",
+			"% Number:   " + str(count+1) + "\n",
+			"% Correct:  " + str_right_answer_letter + "\n",
+			"% Type:     " + q_type + "\n",
+			"% Path:     " + d_type + "/" + q_name + _EXAM_EXTENSION + "\n",
+			"%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%\n",
+			"\\begin{minipage}{\\linewidth}\n",
+			"\\question\n\n",
+			"[" + str_question_score + "]\\ ",
+			q_statement,
+			"\n\n"
+		]
+		if (_ALTERNATIVE_SPACE != ""):
+			chunk.append("\\vspace{" + _ALTERNATIVE_SPACE + "}\n")
+		chunk.append("\\begin{choices}\n")
+		for c in alts_final:
+			chunk.append(c + "\n")
+		chunk.append("\\end{choices}\n\n")
+		chunk.append("\\end{minipage}\n")
+		if (_QUESTION_SPACE != ""):
+			chunk.append("\\vspace{" + _QUESTION_SPACE + "}\n")
+		chunk.append("\n\n")
+		yield "".join(chunk)
 
 		count += 1
 
 ############################################################################
 # 
 ############################################################################
-def generateAnswersFiles():
+def generateAnswersFiles(exam):
 
-	with open(Exam.ANSWERS_FILE, "a+") as arq_prova:
-		for count in range(len(Exam.correctAnswers)):
-			arq_prova.write(f"Q{count+1} - {letter(Exam.correctAnswers[count])}\n");
+	writeFile(exam.ANSWERS_FILE, "".join(f"Q{count+1} - {letter(a)}\n" for count, a in enumerate(exam.correctAnswers)))
+	writeFile(exam.ANSWERS_HORIZ_FILE, "".join(f"{letter(a)}\t\t" for a in exam.correctAnswers))
 
-	with open(Exam.ANSWERS_HORIZ_FILE, "a+") as arq_prova:
-		for count in range(len(Exam.correctAnswers)):
-			arq_prova.write(f"{letter(Exam.correctAnswers[count])}\t\t");
 
+############################################################################
+# Generation manifest (exam new --refresh): selected questions, order of
+# alternatives, correct letters and hash of the source of each question
+############################################################################
+def generateManifest(exam, artifacts):
+	import json
+	manifest = {
+		"version": _MANIFEST_VERSION,
+		"exam": exam.EXAM_NAME,
+		"seed": str(exam.seed),
+		"config": configKey(exam),
+		"question_value": exam.questionValue,
+		"documents": [{"name": a["name"], "questions": [
+				{"directory": d, "type": t, "name": q, "source": source, "alternatives": order, "correct": ord(answer) - ord("A")}
+				for (d, t, q), source, order, answer in zip(a["layout"], a["sources"], a["alternatives"], a["answers"])]
+			} for a in artifacts]
+	}
+	writeFile(exam.EXAM_PATH + exam.EXAM_NAME + _MANIFEST_FILE_SUFFIX, json.dumps(manifest, indent=1))
+
+############################################################################
+# Record questions of all variants in the catalog (queries with not_used_in)
+############################################################################
+def recordUsage(exam, artifacts):
+	import sqlite3
+	from .catalog import Catalog
+	try:
+		catalog = Catalog(bankFile(exam.config, "catalog_", ".sqlite"))
+		catalog.recordUsage(exam.EXAM_NAME, {(d, q) for a in artifacts for d, t, q in a["layout"]})
+		catalog.close()
+	except sqlite3.Error as e:
+		# catalog is optional for generation
+		log(_("!!! Use of questions not recorded in catalog: {}").format(e), 1)
+
+def configKey(exam):
+	import yaml
+	return contentKey([yaml.safe_dump(exam.examConfig, sort_keys=True)])
+
+# hash of statement, alternatives and correct alternative of each question
+def sourceHashes(exam):
+	bank = questionBank(exam)
+	return [questionHash(bank.get(d_type, q_name)) for d_type, q_type, q_name in exam.questions]
+
+def questionHash(entry):
+	import json
+	return contentKey([json.dumps([entry["statement"], entry["alternatives"], entry["correct"]])])
+
+############################################################################
+# Answer key of all variants (exam grade): letters and questions of each
+# variant and the score of each question
+############################################################################
+def generateKeyFile(exam, artifacts):
+	import json
+	key = {
+		"exam": exam.EXAM_NAME,
+		"seed": str(exam.seed),
+		"question_value": exam.questionValue,
+		"variants": [{"name": a["name"], "answers": "".join(a["answers"]), "questions": a["questions"]} for a in artifacts]
+	}
+	for v, a in zip(key["variants"], artifacts):
+		if a["student"] is not None:
+			v["student"] = a["student"]
+	writeFile(exam.EXAM_PATH + exam.EXAM_NAME + _KEY_FILE_SUFFIX, json.dumps(key, indent=1))
+
+############################################################################
+# Generate combined answers file of all variants
+############################################################################
+def generateCombinedAnswersFile(exam, artifacts):
+
+	str_ans = ["Variant" + "".join(f"\tQ{count+1}" for count in range(exam.countExamQuestions)) + "\n"]
+	for variant in artifacts:
+		str_ans.append(variant["name"] + "\t" + "\t".join(variant["answers"]) + "\n")
+
+	writeFile(exam.EXAM_PATH + exam.EXAM_NAME + _ANSWERS_FILE_SUFFIX, str_ans)
+
+############################################################################
+# Generate files of one exam (or variant) from loaded questions
+############################################################################
+def generateVariant(exam):
+	runStage(exam, generateQuestions)
+	runStage(exam, generateCorrectAnswers)
+	runStage(exam, generateAlternatives)
+	if runStage(exam, restoreBuild):
+		return examArtifacts(exam)
+	runStage(exam, generateHeaderFile)
+	runStage(exam, generateAnswerSheet)
+	runStage(exam, generateExamFile)
+	runStage(exam, generateAnswersFiles)
+	return examArtifacts(exam)
+
+############################################################################
+# Run stage fn of exam, timed by exam profiler
+############################################################################
+def runStage(exam, fn, *args):
+	with exam.profiler.stage(fn.__name__):
+		return fn(exam, *args)
+
+############################################################################
+# Generated files and answers of exam (or variant)
+############################################################################
+def examArtifacts(exam):
+	files = [exam.EXAM_FILE, exam.EXAM_HEADER_FILE, exam.QUESTIONS_FILE, exam.ANSWER_SHEET_FILE, exam.ANSWERS_FILE, exam.ANSWERS_HORIZ_FILE]
+	return {
+		"name": exam.EXAM_PREFIX,
+		"path": exam.EXAM_PATH,
+		"files": [f for f in files if os.path.exists(f)],
+		"answers": [letter(a) for a in exam.correctAnswers],
+		"questions": [q_name for d_type, q_type, q_name in exam.questions],
+		"layout": exam.questions,
+		"student": exam.student,
+		"alternatives": exam.alternatives,
+		"sources": sourceHashes(exam),
+		"key": exam.buildKey,
+		"cached": exam.buildCached
+	}
+
+############################################################################
+# Store of template assets (class, logo, ...) shared by exam folders
+############################################################################
+def assetStore(config):
+	return AssetStore(config.PATH_CACHE + "assets/")
+
+############################################################################
+# Folder of precompiled preambles (pdflatex formats)
+############################################################################
+def formatDir(config):
+	return config.PATH_CACHE + "formats/"
+
+############################################################################
+# Build cache of configuration
+############################################################################
+def buildCache(config):
+	return BuildCache(config.PATH_CACHE + "builds/", config.configuration["config"].get("cache", {}).get("size", 500))
+
+############################################################################
+# Key of exam files in build cache: exam configuration, seed, student,
+# template files, selected questions, correct answers and order of
+# alternatives (answers drawn by another version do not match the cache)
+############################################################################
+def buildKey(exam):
+	import yaml
+	import json
+	parts = [__version__, exam.EXAM_PREFIX, yaml.safe_dump(exam.examConfig, sort_keys=True), str(exam.seed), json.dumps(exam.fields, sort_keys=True)]
+	for f in sorted(os.listdir(exam.config.PATH_TEMPLATE)):
+		with open(exam.config.PATH_TEMPLATE + f, "rb") as template:
+			parts += [f, template.read()]
+	bank = questionBank(exam)
+	for d_type, q_type, q_name in exam.questions:
+		entry = bank.get(d_type, q_name)
+		parts.append(json.dumps([d_type, q_name, entry["statement"], entry["alternatives"], entry["correct"]]))
+	parts.append(json.dumps([exam.correctAnswers, exam.alternatives]))
+	return contentKey(parts)
+
+############################################################################
+# Restore exam files from build cache (only reproducible exams, with seed)
+############################################################################
+def restoreBuild(exam):
+	if not exam.seedGiven:
+		return False
+	exam.buildKey = buildKey(exam)
+	if buildCache(exam.config).restore(exam.buildKey, exam.EXAM_PATH) is None:
+		return False
+	exam.buildCached = True
+	log(_("Files of {} restored from build cache.").format(exam.EXAM_PREFIX), 1)
+	return True
+
+############################################################################
+# Store files of generated exams (<name>_*, document, and PDF, aux and
+# stamp of the build) in build cache; shared template files (exam.cls of an exam named
+# exam, ...) are links to the asset store and never stored
+############################################################################
+def storeBuilds(config, artifacts):
+	cache = buildCache(config)
+	for a in artifacts:
+		if a["key"] is None or a["cached"] or not os.path.exists(a["path"] + a["name"] + ".pdf"):
+			continue
+		built = {a["name"] + extension for extension in _BUILD_EXTENSIONS}
+		cache.store(a["key"], [a["path"] + f for f in os.listdir(a["path"])
+			if f not in _FILES_TEMPLATE_GENERAL and (f in built or f.startswith(a["name"] + "_"))])
+
+############################################################################
+# Process pool worker : exam received once from the parent process
+############################################################################
+_workerExam = None
+
+def initVariantWorker(exam):
+	global _workerExam
+	_workerExam = exam
+
+def generateVariantWorker(name, student=None):
+	variant = _workerExam.variant(name)
+	if student is not None:
+		variant.student = student
+		variant.fields.update(studentFields(student))
+	runStage(variant, copyTemplateFiles)
+	artifacts = generateVariant(variant)
+	artifacts["profile"] = variant.profiler.state()
+	return artifacts
+
+############################################################################
+# Generate n variants of exam, spread across a process pool
+############################################################################
+def generateVariants(exam, n):
+	import concurrent.futures
+
+	variants = [variantName(exam.EXAM_NAME, i) for i in range(1, n+1)]
+	log(_("Generating {} variants...").format(n), 1)
+
+	# workers receive only the candidate questions of the bank
+	worker = copy.copy(exam)
+	worker.bank = questionBank(exam).subset([(d, q) for questions in exam.allQuestions for d, t, q in questions])
+	with concurrent.futures.ProcessPoolExecutor(initializer=initVariantWorker, initargs=(worker,)) as executor:
+		artifacts = list(executor.map(generateVariantWorker, variants, exam.roster or [None] * n))
+	for a in artifacts:
+		exam.profiler.merge(a.pop("profile"))
+
+	generateCombinedAnswersFile(exam, artifacts)
+	log(_("Combined answers file {} created.").format(exam.EXAM_NAME + _ANSWERS_FILE_SUFFIX), 1)
+	return artifacts
 
 ############################################################################
 # Loads exam structure : questions, excludes, etc
 ############################################################################
-def generateExam():	
-	generateHeaderFile()
-	generateQuestions()
-	generateCorrectAnswers()
-	generateExamFile()
-	generateAnswersFiles()
+def generateExam(exam, variants=1):
+	if exam.seed is None:
+		exam.seed = exam.examConfig["exam"].get("seed")
+	exam.seedGiven = exam.seed is not None
+	if not exam.seedGiven:
+		exam.seed = newSeed()
+	exam.rng = random.Random(str(exam.seed))
+	log(_("Seed : {}").format(exam.seed), 1)
+	runStage(exam, loadQuestions)
+	if exam.roster:
+		artifacts = generateVariants(exam, len(exam.roster))
+	elif variants > 1:
+		artifacts = generateVariants(exam, variants)
+	else:
+		artifacts = [generateVariant(exam)]
+	runStage(exam, generateKeyFile, artifacts)
+	runStage(exam, generateManifest, artifacts)
+	runStage(exam, recordUsage, artifacts)
+	runStage(exam, saveQuestionIndex)
+	if exam.roster:
+		runStage(exam, generateMergedFile, artifacts)
+		runStage(exam, generateRosterMap)
+	return artifacts
+
+############################################################################
+# Roster CSV: student id and name of each student, a first line starting
+# with "id" is a header (utf-8-sig: spreadsheets export it with a BOM)
+############################################################################
+def readRoster(filename):
+	import csv
+	roster = []
+	try:
+		with open(filename, "r", encoding="utf-8-sig", newline="") as f:
+			for n, row in enumerate(csv.reader(f)):
+				if not row or not row[0].strip() or (n == 0 and row[0].strip().lower() == "id"):
+					continue
+				roster.append([row[0].strip(), row[1].strip() if len(row) > 1 else ""])
+	except (OSError, UnicodeDecodeError, csv.Error) as e:
+		error(_("Reading roster {} failed: {}").format(filename, e))
+	if not roster:
+		error(_("Roster {} has no students.").format(filename))
+	return roster
+
+def studentFields(student):
+	return {"STUDENT_ID": escapeLatex(student[0]), "STUDENT": escapeLatex(student[1])}
+
+############################################################################
+# One document with all variants of the exam (<exam>_all.tex), compiled
+# once: preamble of exam template, then the body of each variant starting
+# on a new page, its first and last pages marked with labels
+############################################################################
+def generateMergedFile(exam, artifacts):
+	template = exam.config.PATH_TEMPLATE + _FILES_TEMPLATE[0]
+	fields = templateFields(exam)
+	text = renderFile(template, fields)
+	begin = text.find(_BEGIN_DOCUMENT)
+	end = text.rfind(_END_DOCUMENT)
+	if begin < 0 or end < begin:
+		error(_("Template {} has no document environment.").format(template))
+
+	out = ["% Seed: {}\n".format(exam.seed), text[:begin + len(_BEGIN_DOCUMENT)], "\n"]
+	for a in artifacts:
+		fields["NAME"] = a["name"]
+		body = renderFile(template, fields)
+		out += ["\n%%% ", a["name"], "\n\\clearpage\n\\setcounter{question}{0}\n",
+			"\\label{", _PAGE_LABEL.format("first", a["name"]), "}",
+			body[body.find(_BEGIN_DOCUMENT) + len(_BEGIN_DOCUMENT):body.rfind(_END_DOCUMENT)],
+			"\\label{", _PAGE_LABEL.format("last", a["name"]), "}\n"]
+	out.append(_END_DOCUMENT + "\n")
+	writeFile(exam.EXAM_PATH + exam.EXAM_NAME + _MERGED_SUFFIX + _EXAM_EXTENSION, out)
+	log(_("Merged file {} created.").format(exam.EXAM_NAME + _MERGED_SUFFIX + _EXAM_EXTENSION), 1)
+
+############################################################################
+# Roster map (<exam>_roster.csv): student, variant, answers and pages of the
+# variant in the merged PDF (pages: variant -> [first, last], after latex)
+############################################################################
+def generateRosterMap(exam, pages=None):
+	import csv
+	import json
+	with open(exam.EXAM_PATH + exam.EXAM_NAME + _KEY_FILE_SUFFIX, "r", encoding="utf-8") as f:
+		key = json.load(f)
+	if pages is None:
+		pages = dict()
+	out = io.StringIO()
+	writer = csv.writer(out)
+	writer.writerow(["student_id", "student", "variant", "answers", "first_page", "last_page"])
+	for v in key["variants"]:
+		student = v.get("student", ["", ""])
+		writer.writerow(student + [v["name"], v["answers"]] + pages.get(v["name"], ["", ""]))
+	writeFile(exam.EXAM_PATH + exam.EXAM_NAME + _ROSTER_FILE_SUFFIX, out.getvalue())
+
+############################################################################
+# Pages of each variant in merged PDF, from labels in its .aux file
+############################################################################
+def mergedPages(exam):
+	pages = dict()
+	aux = exam.EXAM_PATH + exam.EXAM_NAME + _MERGED_SUFFIX + ".aux"
+	if not os.path.exists(aux):
+		return pages
+	with open(aux, "r", encoding="utf-8", errors="replace") as f:
+		for which, name, page in re.findall(_PAGE_LABEL_REGEX, f.read()):
+			pages.setdefault(name, ["", ""])[0 if which == "first" else 1] = int(page)
+	return pages
 
 ############################################################################
 # Execute init command
 ############################################################################
-def commandInit():
+def commandInit(exam):
 
-	if os.path.exists(Exam.EXAM_CONFIG_FILENAME):
-		res = prompt(_("File {} already exists. Want to overwrite?").format(Exam.EXAM_CONFIG_FILENAME))
+	if os.path.exists(exam.EXAM_CONFIG_FILENAME):
+		res = prompt(_("File {} already exists. Want to overwrite?").format(exam.EXAM_CONFIG_FILENAME))
 		if not res:
-			log (_("File {} maintained.").format(Exam.EXAM_CONFIG_FILENAME))
+			log (_("File {} maintained.").format(exam.EXAM_CONFIG_FILENAME))
 			return
 
-	with open(Exam.EXAM_CONFIG_FILE, "w") as myfile:
+	with open(exam.EXAM_CONFIG_FILE, "w") as myfile:
 		myfile.write("# YAML exam example file\n\n")
 		myfile.write("exam:\n")
 		myfile.write("  total_score: 100\n")
@@ -679,214 +1232,594 @@ def commandInit():
 		myfile.write('  test2:\n')
 		myfile.write('    test2_F: 2\n')
   
-	# copyInitFiles(Exam.EXAM_NAME)
-	log (_("Exam {} initialized.").format(Exam.EXAM_NAME))
-	log (_("File {} created.").format(Exam.EXAM_CONFIG_FILE))
+	# copyInitFiles(exam.EXAM_NAME)
+	log (_("Exam {} initialized.").format(exam.EXAM_NAME))
+	log (_("File {} created.").format(exam.EXAM_CONFIG_FILE))
 
 
 ############################################################################
 # Execute new command
 ############################################################################
-def commandNew():
-	log (_("Generating exam {}.").format(Exam.EXAM_NAME)) 
-	cleanFiles()
-	copyInitFiles()
-	generateExam()
-	log(_("Exam {} created.".format(Exam.EXAM_NAME)))
+def commandNew(exam, variants=1):
+	if exam.roster and variants > 1:
+		error(_("Use --roster or --variants, not both: a roster has one variant per student."))
+	log (_("Generating exam {}.").format(exam.EXAM_NAME)) 
+	cleanFiles(exam)
+	runStage(exam, copyInitFiles)
+	if variants <= 1 and not exam.roster:
+		runStage(exam, copyTemplateFiles)
+	artifacts = generateExam(exam, variants)
+	log(_("Exam {} created.".format(exam.EXAM_NAME)))
+	return artifacts
  
+############################################################################
+# Execute new --refresh: with the manifest of the last exam new, render
+# again only the questions files with questions changed since then, keeping
+# selection, order of alternatives and answers (the answer key stays valid)
+############################################################################
+def commandRefresh(exam):
+	import json
+	manifestFile = exam.EXAM_PATH + exam.EXAM_NAME + _MANIFEST_FILE_SUFFIX
+	if not os.path.exists(manifestFile):
+		error(_("Manifest {} does not exist. Generate the exam with exam new first.").format(manifestFile))
+	with open(manifestFile, "r", encoding="utf-8") as f:
+		manifest = json.load(f)
+	if manifest.get("version") != _MANIFEST_VERSION:
+		error(_("Manifest {} is from another version. Run exam new without --refresh.").format(manifestFile))
+	if manifest["config"] != configKey(exam):
+		error(_("Exam file {} changed since the exam was generated. Run exam new without --refresh.").format(exam.EXAM_CONFIG_FILENAME))
+
+	log(_("Refreshing exam {}.").format(exam.EXAM_NAME))
+	exam.seed = manifest["seed"]
+	exam.questionValue = manifest["question_value"]
+	bank = questionBank(exam)
+	bank.fetch([(q["directory"], q["name"]) for document in manifest["documents"] for q in document["questions"]])
+	changed = 0
+	files = 0
+	for document in manifest["documents"]:
+		doc = exam if document["name"] == exam.EXAM_NAME else exam.variant(document["name"])
+		refreshed = 0
+		for q in document["questions"]:
+			try:
+				entry = bank.get(q["directory"], q["name"])
+			except KeyError:
+				error(_("Question {} does not exist anymore. Run exam new without --refresh.").format(q["name"]))
+			source = questionHash(entry)
+			if source != q["source"]:
+				order = refreshedOrder(entry, q["alternatives"], q["correct"])
+				if order is None:
+					error(_("Alternatives of question {} changed. Run exam new without --refresh.").format(q["name"]))
+				q["source"] = source
+				q["alternatives"] = order
+				refreshed += 1
+		if not refreshed:
+			continue
+		doc.questions = [[q["directory"], q["type"], q["name"]] for q in document["questions"]]
+		doc.correctAnswers = [q["correct"] for q in document["questions"]]
+		doc.alternatives = [q["alternatives"] for q in document["questions"]]
+		runStage(doc, generateExamFile)
+		log(_("{} changed questions in {}.").format(refreshed, doc.QUESTIONS_FILENAME), 1)
+		changed += refreshed
+		files += 1
+
+	if changed:
+		writeFile(manifestFile, json.dumps(manifest, indent=1))
+	runStage(exam, saveQuestionIndex)
+	log(_("Exam {} refreshed: {} questions changed in {} files.").format(exam.EXAM_NAME, changed, files))
+
+# order of alternatives of a changed question with its correct alternative
+# at the same letter, None if the alternatives can not be kept
+def refreshedOrder(entry, order, correct):
+	if len(order) != len(entry["alternatives"]) or entry["correct"] is None:
+		return None
+	order = list(order)
+	i = order.index(entry["correct"])
+	order[i], order[correct] = order[correct], order[i]
+	return order
+
 ############################################################################
 # Execute clone command
 ############################################################################
-def commandClone(s):
-	log (_("Cloning exam {}.".format(Exam.EXAM_NAME)))
-	if os.path.exists(Exam.EXAM_NAME + _EXTENSION):
-		shutil.copy(Exam.EXAM_NAME + _EXTENSION, s + _EXTENSION)
+def commandClone(exam, s):
+	log (_("Cloning exam {}.".format(exam.EXAM_NAME)))
+	if os.path.exists(exam.EXAM_NAME + _EXTENSION):
+		shutil.copy(exam.EXAM_NAME + _EXTENSION, s + _EXTENSION)
 	log (_("Exam {} created.").format(s))
  
 ############################################################################
 # Execute showConfig command
 ############################################################################
-def commandShowConfig():
-	pprint(Config.__dict__)
+def commandShowConfig(config):
+	from pprint import pprint
+	pprint(config.__dict__)
 
 ############################################################################
 # Execute show command
 ############################################################################
-def commandShow():
-	log("PATH_SCRIPT = " + Config.PATH_SCRIPT)
-	log("EXAM_NAME = " + Exam.EXAM_NAME)
-	log("EXAM_PATH = " + Exam.EXAM_PATH)
-	log("PATH_TEMPLATE = " + Config.PATH_TEMPLATE)
-	log("EXAM_CONFIG_FILE = " + Exam.EXAM_CONFIG_FILE)
-	log("PATH_QUESTIONS = " + Config.PATH_QUESTIONS)
+def commandShow(exam):
+	log("PATH_SCRIPT = " + exam.config.PATH_SCRIPT)
+	log("EXAM_NAME = " + exam.EXAM_NAME)
+	log("EXAM_PATH = " + exam.EXAM_PATH)
+	log("PATH_TEMPLATE = " + exam.config.PATH_TEMPLATE)
+	log("EXAM_CONFIG_FILE = " + exam.EXAM_CONFIG_FILE)
+	log("PATH_QUESTIONS = " + exam.config.PATH_QUESTIONS)
  
 ############################################################################
 # Execute generate command
 ############################################################################
-def commandGenerate():
-	commandNew()
-	commandLatex()
+def commandGenerate(exam, variants=1, workers=None):
+	artifacts = commandNew(exam, variants)
+	commandLatex([exam], workers, profiler=exam.profiler)
+	storeBuilds(exam.config, artifacts)
  
 ############################################################################
 # Execute clear command
 ############################################################################
-def commandClear():
-	if os.path.exists(Exam.EXAM_PATH):
-		res = prompt(_("Want to remove files in directory {} ?").format(Exam.EXAM_NAME))
+def commandClear(exam):
+	if os.path.exists(exam.EXAM_PATH):
+		res = prompt(_("Want to remove files in directory {} ?").format(exam.EXAM_NAME))
 		if res:
-			log(_("Removing files in {}").format(Exam.EXAM_PATH), 1)
-			removeFilesFromDirectory(Exam.EXAM_PATH)
+			log(_("Removing files in {}").format(exam.EXAM_PATH), 1)
+			removeFilesFromDirectory(exam.EXAM_PATH)
+			assetStore(exam.config).prune()
 	else:
-		log(_("Nothing to clear, {} directory does not exists.").format(Exam.EXAM_NAME))
+		log(_("Nothing to clear, {} directory does not exists.").format(exam.EXAM_NAME))
  
 ############################################################################
 # Execute remove command
 ############################################################################
-def commandRemove():
-	if os.path.exists(Exam.EXAM_PATH):
-		res = prompt(_("Want to remove all exam files ({}) ?").format(Exam.EXAM_NAME))
+def commandRemove(exam):
+	if os.path.exists(exam.EXAM_PATH):
+		res = prompt(_("Want to remove all exam files ({}) ?").format(exam.EXAM_NAME))
 		if res:
-			log(_("Removing files in {}").format(Exam.EXAM_PATH), 1)
-			shutil.rmtree(Exam.EXAM_PATH)
-			removeFile(Exam.EXAM_NAME + _EXTENSION)
+			log(_("Removing files in {}").format(exam.EXAM_PATH), 1)
+			shutil.rmtree(exam.EXAM_PATH)
+			removeFile(exam.EXAM_NAME + _EXTENSION)
+			assetStore(exam.config).prune()
 	else:
-		log(_("Nothing to clear, {} directory does not exists.").format(Exam.EXAM_NAME))
+		log(_("Nothing to clear, {} directory does not exists.").format(exam.EXAM_NAME))
  
 ############################################################################
-# Execute questions command - list all questions
+# Questions of bank by directory, streamed: (directory, { prefix -> ids })
+# for directories and prefixes matching the globs
+############################################################################
+def questionGroups(bank, dirs="*", prefixes="*"):
+	import fnmatch
+	for d in sorted(bank.directories):
+		if not fnmatch.fnmatchcase(d, dirs):
+			continue
+		index = bank.prefixes(d)
+		yield d, {p: index[p] for p in sorted(index) if fnmatch.fnmatchcase(p, prefixes)}
+
+############################################################################
+# Execute questions command - list all questions (text, json or csv)
 ############################################################################
-def commandQuestions():
-	log(_("Questions Path : {}").format(Config.PATH_QUESTIONS))
+def commandQuestions(config, dirs="*", prefixes="*", format="text"):
+	bank = loadBank(config)
+	if format == "json":
+		writeQuestionsJSON(config, bank, dirs, prefixes)
+	elif format == "csv":
+		writeQuestionsCSV(config, bank, dirs, prefixes)
+	else:
+		writeQuestionsText(config, bank, dirs, prefixes)
+
+def writeQuestionsText(config, bank, dirs, prefixes):
+	log(_("Questions Path : {}").format(config.PATH_QUESTIONS))
 	print("")
+	for s1 in bank.loose:
+		log(_("Question not in folder (not counted): {}").format(s1))
+
+	for d, index in questionGroups(bank, dirs, prefixes):
+		log(f"{d} - (n-types: {len(index)}, n-questions: {sum(len(ids) for ids in index.values())})", 0)
+		for prefix, ids in index.items():
+			log(f"{prefix} - ({len(ids)}) ", 1)
+			for q_id in ids:
+				log(q_id + _QUESTION_EXTENSION + " : " + ", ".join(getRestrictions(config, q_id)), 2)
+
+# one JSON array, written item by item
+def writeQuestionsJSON(config, bank, dirs, prefixes):
+	import json
+	sep = "[\n"
+	for d, index in questionGroups(bank, dirs, prefixes):
+		for prefix, ids in index.items():
+			for q_id in ids:
+				item = {"directory": d, "prefix": prefix, "id": q_id, "file": q_id + _QUESTION_EXTENSION,
+					"restrictions": getRestrictions(config, q_id)}
+				sys.stdout.write(sep + json.dumps(item))
+				sep = ",\n"
+	sys.stdout.write("[]\n" if sep == "[\n" else "\n]\n")
+
+def writeQuestionsCSV(config, bank, dirs, prefixes):
+	import csv
+	writer = csv.writer(sys.stdout)
+	writer.writerow(["directory", "prefix", "id", "file", "restrictions"])
+	for d, index in questionGroups(bank, dirs, prefixes):
+		for prefix, ids in index.items():
+			for q_id in ids:
+				writer.writerow([d, prefix, q_id, q_id + _QUESTION_EXTENSION, " ".join(getRestrictions(config, q_id))])
+
+############################################################################
+# Execute check command: question files (in parallel, cached), restrictions
+# of config.yaml and quantities of exam files in current folder
+############################################################################
+def commandCheck(config, workers=None):
+	import glob
+	import yaml
+	from .check import checkFiles, checkSource, ERROR, WARNING
+
+	issues = []    # [level, where, message]
+	files = []
+	storage = questionStorage(config)
+	directories, loose = storage.list()
+	for name in loose:
+		issues.append([WARNING, name, "question not in folder, not used"])
+	for d in sorted(directories):
+		files += sorted(d + "/" + name for name, mtime, size in directories[d] if name.endswith(_QUESTION_EXTENSION))
+	if isinstance(storage, DirectoryStorage):
+		results, checked = checkFiles([config.PATH_QUESTIONS + f for f in files], bankFile(config, "check_", ".json"), workers)
+		results = {os.path.relpath(f, config.PATH_QUESTIONS): found for f, found in results.items()}
+	else:
+		# archive or database: files read in one call, checked here
+		texts = storage.get_many([tuple(f.split("/")) for f in files])
+		results = {f: checkSource(f, texts[tuple(f.split("/"))]) for f in files}
+		checked = len(files)
+	for f in files:
+		issues += [[level, f, message] for level, message in results[f]]
+
+	bank = loadBank(config)
+	catalog = None
+	known = {q_id for d in bank.directories for q_id in bank.directories[d]}
+	for i, restriction in enumerate(config.configuration["config"].get("restrictions") or []):
+		for q in restriction:
+			if q not in known:
+				issues.append([WARNING, config.CONFIG_FILE, _("restriction {} names nonexistent question {}").format(i+1, q)])
+
+	for filename in sorted(glob.glob(config.CWD + "*" + _EXTENSION)):
+		if os.path.basename(filename) == os.path.basename(config.CONFIG_FILE):
+			continue
+		with open(filename, "r") as file:
+			examConfig = yaml.safe_load(file)
+		if not isinstance(examConfig, dict):
+			continue
+		for i, query in enumerate(examConfig.get("queries") or []):
+			if catalog is None:
+				catalog = questionCatalog(config, bank, Profiler())
+			try:
+				available = len(catalog.select(query, removeSuffix(os.path.basename(filename), _EXTENSION)))
+			except (ValueError, AttributeError) as e:
+				issues.append([ERROR, os.path.basename(filename), _("query {} is invalid: {}").format(i+1, e)])
+				continue
+			c = query.get("count")
+			if c is None or (c == "*" and available == 0) or (c != "*" and c > available):
+				issues.append([ERROR, os.path.basename(filename), _("{} questions of query {} asked, {} in database").format(c, i+1, available)])
+		if not isinstance(examConfig.get("questions"), dict):
+			continue
+		for d, prefixes in examConfig["questions"].items():
+			if not bank.hasDirectory(d):
+				issues.append([ERROR, os.path.basename(filename), _("question folder {} does not exist").format(d)])
+				continue
+			for q, c in prefixes.items():
+				available = len(bank.questions(d, q))
+				if (c == "*" and available == 0) or (c != "*" and c > available):
+					issues.append([ERROR, os.path.basename(filename), _("{} questions of {} asked, {} in database").format(c, q, available)])
+	if catalog is not None:
+		catalog.close()
+		bank.saveFetched()
+
+	for level, where, message in issues:
+		log("{} {}: {}".format(level.upper(), where, message))
+	errors = sum(1 for i in issues if i[0] == ERROR)
+	log(_("{} question files checked ({} changed), {} errors, {} warnings.").format(len(files), checked, errors, len(issues) - errors))
+	if errors:
+		sys.exit(1)
+
+############################################################################
+# Execute catalog command: update catalog of questions and show a summary
+############################################################################
+def commandCatalog(config):
+	bank = loadBank(config)
+	catalog = questionCatalog(config, bank, Profiler())
+	summary = catalog.summary()
+	catalog.close()
+	bank.saveFetched()
+	log(_("Catalog {}: {} questions.").format(catalog.filename, summary["questions"]))
+	log(_("Difficulty: {}").format(", ".join("{}={}".format("-" if d is None else d, n) for d, n in summary["difficulty"])))
+	log(_("Tags: {}").format(", ".join("{} ({})".format(tag, n) for tag, n in summary["tags"]) or "-"))
+	for name, date, count in summary["exams"]:
+		log(_("Exam {} generated {} ({} questions)").format(name, date, count), 1)
+
+############################################################################
+# Execute grade command: score responses CSV with answer keys of exam
+############################################################################
+def commandGrade(exam, responsesFile, scoresFile=None, statsFile=None):
+	from .grade import AnswerKeys, readResponses, grade, writeScores, writeStatistics
+
+	keyFile = exam.EXAM_PATH + exam.EXAM_NAME + _KEY_FILE_SUFFIX
+	if not os.path.exists(keyFile):
+		error(_("Answer key {} does not exist. Generate the exam first.").format(keyFile))
+	keys = AnswerKeys(keyFile)
+	try:
+		students, variants, responses = readResponses(responsesFile, keys)
+	except (OSError, ValueError) as e:
+		error(_("Reading responses {} failed: {}").format(responsesFile, e))
+
+	with exam.profiler.stage("grade"):
+		scores, stats = grade(keys, variants, responses)
+
+	if scoresFile is None:
+		scoresFile = exam.config.CWD + exam.EXAM_NAME + "_scores.csv"
+	if statsFile is None:
+		statsFile = exam.config.CWD + exam.EXAM_NAME + "_statistics.csv"
+	writeScores(scoresFile, keys, students, variants, scores)
+	writeStatistics(statsFile, keys, stats)
+
+	points = [score[3] for score in scores]
+	if points:
+		log(_("{} students graded: mean {:.2f}, min {}, max {}.").format(len(points), sum(points) / len(points), min(points), max(points)))
+	log(_("Scores written to {}, statistics of questions to {}.").format(scoresFile, statsFile))
+
+############################################################################
+# Execute pack command: compile question bank in one file
+############################################################################
+def commandPack(config):
+	filename = bankFile(config, "pack_", ".pack")
+	bank = PackedBank(config.PATH_QUESTIONS, filename, questionStorage(config))
+	bank.open()
+	bank.refresh()
+	try:
+		bank.save()
+	except OSError as e:
+		error(_("Writing pack file {} failed: {}").format(filename, e))
+	count = sum(len(bank.directories[d]) for d in bank.directories)
+	log(_("{} questions ({} parsed) packed in {} ({} KB).").format(count, bank.parsed, filename, os.path.getsize(filename) // 1024))
+	bank.close()
  
-	dict_questions = dict()
-	q_type = ""
-	q_type_old = ""
-	subs1 = os.listdir(Config.PATH_QUESTIONS)
-	subs1.sort()
-	for s1 in subs1:
-		if os.path.isdir(Config.PATH_QUESTIONS + s1):
-			dict_questions[s1] = dict()
-			q_type_old = ""
-			subs2 = os.listdir(Config.PATH_QUESTIONS + s1)
-			subs2.sort()
-			for s2 in subs2:
-				if os.path.isfile(slash(Config.PATH_QUESTIONS + s1) + s2):
-					if s2==".DS_Store":
-						continue
-					res = re.search(r"(^[A-Za-z0-9_]+)_q[0-9]+\.tex", s2)
-					if res:
-						q_type = res.group(1)
-						if q_type!=q_type_old:
-							dict_questions[s1][q_type] = []
-							q_type_old = q_type
-						dict_questions[s1][q_type].append(s2)
-		else:
-			if os.path.isfile(Config.PATH_QUESTIONS + s1):
-				if s1==".DS_Store":
-					continue
-				log(_("Question not in folder (not counted): {}").format(s1))
-
-	for type in dict_questions:
-		log(f"{type} - (n-types: {len(dict_questions[type])}, n-questions: {sum(len(v) for v in dict_questions[type].values())})", 0)
-		for prefix in dict_questions[type]:
-			log(f"{prefix} - ({len(dict_questions[type][prefix])}) ", 1)
-			for question in dict_questions[type][prefix]:
-				rest_list = getRestrictions(removeSuffix(question, _EXAM_EXTENSION))
-				log(question + " : " + ", ".join(rest_list), 2)
-       
- 
+############################################################################
+# Execute store command: copy question files of the questions path (any
+# storage) to SQLite database, which can then be the questions path
+############################################################################
+def commandStore(config, database):
+	import sqlite3
+	from .storage import SQLiteStorage
+	if storageKind(database) != "sqlite":
+		error(_("Database {} must end with .sqlite or .db.").format(database))
+	storage = questionStorage(config)
+	directories, loose = storage.list()
+	stats = {(d, name): mtime for d in directories for name, mtime, size in directories[d] if name.endswith(_QUESTION_EXTENSION)}
+	target = SQLiteStorage(database)
+	try:
+		texts = storage.get_many(list(stats))
+		stored = target.list()[0] if os.path.exists(database) else dict()
+		target.put_many({key: (stats[key], text) for key, text in texts.items()})
+		# files no longer in questions path
+		target.delete_many([(d, name) for d in stored for name, mtime, size in stored[d] if (d, name) not in stats])
+	except (OSError, UnicodeDecodeError, sqlite3.Error) as e:
+		error(_("Storing questions in {} failed: {}").format(database, e))
+	log(_("{} question files stored in {}.").format(len(texts), database))
+
+############################################################################
+# Execute serve command: configuration and questions stay loaded
+############################################################################
+def commandServe(config, host, port, workers=None):
+	import asyncio
+	from .server import serve
+	try:
+		asyncio.run(serve(ExamBuilder(config), host, port, workers))
+	except KeyboardInterrupt:
+		pass
+	except OSError as e:
+		error(_("Server failed: {}").format(e))
+
 ############################################################################
 # 
 ############################################################################
-def commandLatex():
+def commandLatex(exams, workers=None, force=False, profiler=None):
 
-	if not find_executable('pdflatex'): 
+	if not shutil.which('pdflatex'):
 		error(_("Software 'pdflatex' not installed. Install it first to generate PDFs."))
   
-	log (_("Compiling TEX files from exam {}.").format(Exam.EXAM_NAME)) 
-
-	os.chdir(Exam.EXAM_NAME)
-	latex_command1 = ["pdflatex", "-interaction", "batchmode", "-no-shell-escape", "-output-directory", ".", Exam.EXAM_NAME + ".tex"]
-	# latex_command2 = ["pdflatex", "-interaction", "batchmode", "-no-shell-escape", "-output-directory", ".", Exam.EXAM_NAME + "_gabarito.tex"]
+	# compile the merged document of a roster, all variants, or the exam
+	# itself if it has no variants
+	jobs = []
+	for exam in exams:
+		log (_("Compiling TEX files from exam {}.").format(exam.EXAM_NAME)) 
+		merged = exam.EXAM_NAME + _MERGED_SUFFIX
+		if os.path.exists(exam.EXAM_PATH + merged + _EXAM_EXTENSION):
+			# inputs of merged document are the files of all variants
+			inputs = [f for f in os.listdir(exam.EXAM_PATH) if re.match(re.escape(exam.EXAM_NAME) + _VARIANT_REGEX + "_", f)]
+			jobs.append((exam, merged, _FILES_TEMPLATE_GENERAL + inputs))
+			continue
+		documents = listVariants(exam)
+		if not documents:
+			documents = [exam.EXAM_NAME]
+		jobs += [(exam, document, _FILES_TEMPLATE_GENERAL) for document in documents]
+
+	if profiler is None:
+		profiler = Profiler()
+
+	# preamble of each exam dumped once in a format (documents of an exam
+	# share it), compiled without it if it can not be dumped
+	formats = dict()
+	with profiler.stage("preambleFormat"):
+		for exam, document, shared in jobs:
+			if exam.EXAM_PATH not in formats:
+				formats[exam.EXAM_PATH] = preambleFormat(exam.EXAM_PATH, document, _FILES_TEMPLATE_GENERAL, formatDir(exam.config))
+
+	with profiler.stage("compileDocuments"):
+		results = compileDocuments([(exam.EXAM_PATH, document, shared, formats[exam.EXAM_PATH]) for exam, document, shared in jobs], workers, force, profiler)
+	for result in results:
+		profiler.count("documents " + result)
+
+	failed = False
+	for (exam, document, shared), result in zip(jobs, results):
+		if result == FAILED:
+			log (_("!!! Error generating exam: {}.pdf not generated.").format(document), 1)
+			failed = True
+			continue
+		if document == exam.EXAM_NAME + _MERGED_SUFFIX:
+			generateRosterMap(exam, mergedPages(exam))
+			log (_("Pages of each student in {}.").format(exam.EXAM_NAME + _ROSTER_FILE_SUFFIX), 1)
+		copyPDF(exam, document, result)
+	if failed:
+		sys.exit(1)
 
-	subprocess.call(latex_command1)
-	subprocess.call(latex_command1)
+############################################################################
+# Copy PDF of document (inside exam folder) to parent folder
+############################################################################
+def copyPDF(exam, document, result):
 
-	#subprocess.call(latex_command2)
-	#subprocess.call(latex_command2)
-	
-	if not os.path.exists(Exam.EXAM_NAME + ".pdf"):
-		log (_("!!! Error generating exam: {}.pdf not generated.").format(Exam.EXAM_NAME), 1)
-		sys.exit(1)
+	pdf = exam.EXAM_PATH + document + ".pdf"
+	target = exam.config.CWD + document + ".pdf"
+	if result == SKIPPED and os.path.exists(target):
+		log (_("PDF {}.pdf is up to date.").format(document)) 
+		return
 
-	if os.path.exists("../" + Exam.EXAM_NAME + ".pdf"):
-		log(_("Backing up file {}.pdf to {}_bak.pdf").format(Exam.EXAM_NAME, Exam.EXAM_NAME), 1)
-		shutil.copy("../" + Exam.EXAM_NAME + ".pdf", "../" + Exam.EXAM_NAME + "_bak.pdf")
-		os.remove("../" + Exam.EXAM_NAME + ".pdf") 
+	if os.path.exists(target):
+		log(_("Backing up file {}.pdf to {}_bak.pdf").format(document, document), 1)
+		shutil.copy(target, exam.config.CWD + document + "_bak.pdf")
+		os.remove(target) 
   
-	shutil.copy(Exam.EXAM_NAME + ".pdf", "../")
-	os.chdir("..")
-	log (_("PDF generated {}.pdf.").format(Exam.EXAM_NAME)) 
+	shutil.copy(pdf, exam.config.CWD)
+	log (_("PDF generated {}.pdf.").format(document)) 
 
    
 ################################################################################
 # Typer Commands
 
+############################################################################
+# Exam of command line, with configuration and exam file loaded
+############################################################################
+def cliExam(name, loadExam=True, seed=None, profiler=None, roster=None):
+	exam = Exam(loadConfig(), name)
+	if loadExam:
+		exam.examConfig = loadExamConfig(exam)
+	exam.seed = seed
+	if roster is not None:
+		exam.roster = readRoster(roster)
+	if profiler is not None:
+		exam.profiler = profiler
+	return exam
+
+############################################################################
+# Profiler of command line (--profile, --profile-file)
+############################################################################
+def cliProfiler(profile, profileFile):
+	return Profiler(profile or profileFile is not None)
+
+def reportProfile(profiler, profileFile):
+	if not profiler.enabled:
+		return
+	print("")
+	for line in profiler.table():
+		log(line)
+	if profileFile is not None:
+		profiler.write(profileFile)
+		log(_("Profile written to {} (Chrome trace format).").format(profileFile))
+
 @app.command()
 def init(exam: str = typer.Argument(..., help=_("Name of exam that will be created"))):
-    defineGlobals(exam)
-    commandInit()
+    commandInit(cliExam(exam, loadExam=False))
     
 @app.command()
-def new(exam: str = typer.Argument(..., help=_("Exam to generate"))):
-	defineGlobals(exam)
-	Exam.examConfig = loadExamConfig()
-	commandNew()
+def new(exam: str = typer.Argument(..., help=_("Exam to generate")),
+		variants: int = typer.Option(1, "--variants", "-n", help=_("Number of shuffled variants to generate")),
+		seed: str = typer.Option(None, "--seed", help=_("Seed to generate the same exam again")),
+		roster: str = typer.Option(None, "--roster", help=_("CSV file of students (id, name): one variant per student")),
+		refresh: bool = typer.Option(False, "--refresh", help=_("Render again only questions changed since last exam new, keeping questions and answers")),
+		profile: bool = typer.Option(False, "--profile", help=_("Show time and memory of each stage")),
+		profile_file: str = typer.Option(None, "--profile-file", help=_("Write profile to JSON file (Chrome trace format)"))):
+	profiler = cliProfiler(profile, profile_file)
+	if refresh:
+		# refresh keeps questions, seed and variants of the last exam new
+		if seed is not None or variants != 1 or roster is not None:
+			error(_("--refresh keeps the exam of the last exam new: do not use it with --seed, --variants or --roster."))
+		commandRefresh(cliExam(exam, profiler=profiler))
+	else:
+		commandNew(cliExam(exam, seed=seed, profiler=profiler, roster=roster), variants)
+	reportProfile(profiler, profile_file)
     
 @app.command()
-def latex(exam: str = typer.Argument(..., help=_("Exam to compile to PDF"))):
-    defineGlobals(exam)
-    Exam.examConfig = loadExamConfig()
-    commandLatex()
+def latex(exams: List[str] = typer.Argument(..., help=_("Exams to compile to PDF")),
+		jobs: int = typer.Option(None, "--jobs", "-j", help=_("Number of pdflatex processes at once")),
+		force: bool = typer.Option(False, "--force", "-f", help=_("Compile even if files did not change")),
+		profile: bool = typer.Option(False, "--profile", help=_("Show time and memory of each stage")),
+		profile_file: str = typer.Option(None, "--profile-file", help=_("Write profile to JSON file (Chrome trace format)"))):
+    profiler = cliProfiler(profile, profile_file)
+    commandLatex([cliExam(exam) for exam in exams], jobs, force, profiler)
+    reportProfile(profiler, profile_file)
+
+@app.command()
+def generate(exam: str = typer.Argument(..., help=_("Exam to generate files")),
+		variants: int = typer.Option(1, "--variants", "-n", help=_("Number of shuffled variants to generate")),
+		jobs: int = typer.Option(None, "--jobs", "-j", help=_("Number of pdflatex processes at once")),
+		seed: str = typer.Option(None, "--seed", help=_("Seed to generate the same exam again")),
+		roster: str = typer.Option(None, "--roster", help=_("CSV file of students (id, name): one variant per student, merged in one PDF")),
+		profile: bool = typer.Option(False, "--profile", help=_("Show time and memory of each stage")),
+		profile_file: str = typer.Option(None, "--profile-file", help=_("Write profile to JSON file (Chrome trace format)"))):
+    profiler = cliProfiler(profile, profile_file)
+    commandGenerate(cliExam(exam, seed=seed, profiler=profiler, roster=roster), variants, jobs)
+    reportProfile(profiler, profile_file)
+
+@app.command()
+def questions(dirs: str = typer.Option("*", "--dir", help=_("Only directories matching glob")),
+		prefixes: str = typer.Option("*", "--prefix", help=_("Only question types (prefixes) matching glob")),
+		format: str = typer.Option("text", "--format", help=_("Output format: text, json or csv"))):
+    if format not in ("text", "json", "csv"):
+        error(_("Unknown format {}, use text, json or csv.").format(format))
+    commandQuestions(loadConfig(), dirs, prefixes, format)
+
+@app.command()
+def check(jobs: int = typer.Option(None, "--jobs", "-j", help=_("Number of processes checking files at once"))):
+    commandCheck(loadConfig(), jobs)
+
+@app.command()
+def grade(exam: str = typer.Argument(..., help=_("Exam to grade")),
+		responses: str = typer.Argument(..., help=_("CSV file: student, variant, answers")),
+		output: str = typer.Option(None, "--output", "-o", help=_("CSV file of scores (default <exam>_scores.csv)")),
+		stats: str = typer.Option(None, "--stats", help=_("CSV file of question statistics (default <exam>_statistics.csv)")),
+		profile: bool = typer.Option(False, "--profile", help=_("Show time and memory of each stage")),
+		profile_file: str = typer.Option(None, "--profile-file", help=_("Write profile to JSON file (Chrome trace format)"))):
+    profiler = cliProfiler(profile, profile_file)
+    commandGrade(cliExam(exam, loadExam=False, profiler=profiler), responses, output, stats)
+    reportProfile(profiler, profile_file)
+
+@app.command()
+def catalog():
+    commandCatalog(loadConfig())
+
+@app.command()
+def pack():
+    commandPack(loadConfig())
 
 @app.command()
-def generate(exam: str = typer.Argument(..., help=_("Exam to generate files"))):
-    defineGlobals(exam)
-    Exam.examConfig = loadExamConfig()
-    commandGenerate()
+def store(database: str = typer.Argument(..., help=_("SQLite database (.sqlite or .db) to write question files to"))):
+    commandStore(loadConfig(), database)
 
 @app.command()
-def questions():
-    commandQuestions()
+def serve(host: str = typer.Option("127.0.0.1", "--host", help=_("Address to listen on")),
+		port: int = typer.Option(8765, "--port", "-p", help=_("Port to listen on")),
+		jobs: int = typer.Option(None, "--jobs", "-j", help=_("Number of pdflatex processes at once"))):
+    commandServe(loadConfig(), host, port, jobs)
 
 @app.command()
 def remove(exam: str = typer.Argument(..., help=_("Exam to remove"))):
-    defineGlobals(exam)
-    Exam.examConfig = loadExamConfig()
-    commandRemove()
+    commandRemove(cliExam(exam))
 
 @app.command()
 def clear(exam: str = typer.Argument(..., help=_("Exam to clear"))):
-    defineGlobals(exam)
-    Exam.examConfig = loadExamConfig()
-    commandClear()
+    commandClear(cliExam(exam))
 
 @app.command()
 def show(exam: str = typer.Argument(..., help=_("Exam to show details"))):
-    defineGlobals(exam)
-    Exam.examConfig = loadExamConfig()
-    commandShow()
+    commandShow(cliExam(exam))
 
 @app.command()
 def showconfig():
-    commandShow()
+    commandShowConfig(loadConfig())
 
 @app.command()
 def clone(exam_from: str = typer.Argument(..., help=_("Exam source")), exam_to: str = typer.Argument(..., help=_("Exam target"))):
-    defineGlobals(exam_from)
-    Exam.examConfig = loadExamConfig()
-    commandClone(exam_to)
+    commandClone(cliExam(exam_from), exam_to)
 
 def setHelp():
 	# used to translate docstring of funcions
@@ -900,6 +1833,12 @@ def setHelp():
     remove.__doc__=_("remove all exam files")
     clone.__doc__=_("copy exam <exam_from>.yaml to <exam_to>.yaml")
     questions.__doc__=_("show all questions and restrictions")
+    check.__doc__=_("check question files, restrictions and quantities of exams")
+    grade.__doc__=_("grade answer sheets (CSV) with the answer keys of exam")
+    catalog.__doc__=_("update catalog of questions (tags, difficulty, use) and show a summary")
+    pack.__doc__=_("compile all questions in one pack file, used instead of question files")
+    store.__doc__=_("copy question files to a SQLite database, usable as questions path")
+    serve.__doc__=_("serve exam generation over a local HTTP API")
     
     
 def version_callback(value: bool):
@@ -915,7 +1854,6 @@ def common(
 
 def main():
 	setHelp()
-	loadConfig()
 	app()
 	return 0
             
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/files.py
+"""Atomic writes of files: data goes to a temp file unique to the process
+and thread, in the folder of the target, renamed over the target. Readers
+never see a partial file and writers of the same file never clash."""
+
+import os
+import shutil
+import tempfile
+
+
+# permissions of new files (mkstemp creates them readable only by owner)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+_FILE_MODE = 0o666 & ~_UMASK
+
+
+############################################################################
+# Unique temp file next to filename (folder created): returns fd, path
+############################################################################
+def tempFile(filename):
+	folder = os.path.dirname(filename) or "."
+	os.makedirs(folder, exist_ok=True)
+	return tempfile.mkstemp(dir=folder, prefix=os.path.basename(filename) + ".", suffix=".tmp")
+
+############################################################################
+# Write data (str, bytes or chunks of them; str as UTF-8) to filename,
+# with permissions mode (default of new files)
+############################################################################
+def writeFile(filename, data, mode=None):
+	fd, temp = tempFile(filename)
+	try:
+		with os.fdopen(fd, "wb") as f:
+			for chunk in ([data] if isinstance(data, (str, bytes)) else data):
+				f.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+		os.chmod(temp, _FILE_MODE if mode is None else mode)
+		os.replace(temp, filename)
+	finally:
+		if os.path.exists(temp):
+			os.remove(temp)
+
+############################################################################
+# Copy (or move) file source to filename, with permissions mode
+############################################################################
+def copyFile(source, filename, mode=None, move=False):
+	fd, temp = tempFile(filename)
+	os.close(fd)
+	try:
+		if move:
+			shutil.move(source, temp)
+		else:
+			shutil.copyfile(source, temp)
+		os.chmod(temp, _FILE_MODE if mode is None else mode)
+		os.replace(temp, filename)
+	finally:
+		if os.path.exists(temp):
+			os.remove(temp)
+
+############################################################################
+# Write a file of a cache: a failure only leaves the cache without it
+# returns True if written
+############################################################################
+def writeCacheFile(filename, data):
+	try:
+		writeFile(filename, data)
+	except OSError:
+		return False
+	return True
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/grade.py
+"""Grading of answer sheets against the answer keys of exam variants.
+
+Keys are a variants x questions matrix and responses a students x
+questions matrix (uint8, letter index, _BLANK for no answer), graded in
+one vectorized pass with NumPy, or row by row when NumPy is not installed.
+"""
+
+import csv
+import json
+
+try:
+	import numpy
+except ImportError:
+	# optional, grading is slower without it
+	numpy = None
+
+
+_BLANK = 255                # no answer
+_INVALID = 254              # not a letter, always wrong
+_BLANK_MARKS = ("", "-", "*", ".")
+
+
+############################################################################
+# Answer keys of an exam (<exam>_key.json written by exam new)
+############################################################################
+class AnswerKeys:
+
+	def __init__(self, filename):
+		with open(filename, "r", encoding="utf-8") as f:
+			data = json.load(f)
+		self.exam = data["exam"]
+		self.questionValue = data["question_value"]
+		self.names = [v["name"] for v in data["variants"]]
+		self.rows = [[ord(a) - ord("A") for a in v["answers"]] for v in data["variants"]]
+		self.count = len(self.rows[0]) if self.rows else 0
+		# variant of each student of a roster (exam new --roster)
+		self.students = {v["student"][0]: i for i, v in enumerate(data["variants"]) if "student" in v}
+
+		# global index of each question, to count statistics by question
+		self.questions = []
+		index = dict()
+		self.questionIndex = []
+		for v in data["variants"]:
+			row = []
+			for q in v["questions"]:
+				if q not in index:
+					index[q] = len(self.questions)
+					self.questions.append(q)
+				row.append(index[q])
+			self.questionIndex.append(row)
+
+		if numpy is not None:
+			self.keys = numpy.array(self.rows, dtype=numpy.uint8).reshape(len(self.rows), self.count)
+			self.questionIndex = numpy.array(self.questionIndex, dtype=numpy.int32).reshape(len(self.rows), self.count)
+
+	# index of variant by name (exam_v001), number (1) or empty for the
+	# only variant or the variant of student in roster; None if unknown
+	def variant(self, s, student=None):
+		s = s.strip()
+		if s in self.names:
+			return self.names.index(s)
+		if s == "" and len(self.names) == 1:
+			return 0
+		if s == "" and student in self.students:
+			return self.students[student]
+		if s.isdigit():
+			for i, name in enumerate(self.names):
+				if name.endswith("_v{:03d}".format(int(s))):
+					return i
+		return None
+
+############################################################################
+# Responses CSV: student, variant, answer of each question (letter, blank
+# or - for no answer); a first line starting with "student" is a header.
+# utf-8-sig: files exported by spreadsheets start with a BOM
+# returns students, variant of each student and responses
+############################################################################
+def readResponses(filename, keys):
+	students = []
+	variants = []
+	responses = []
+	with open(filename, "r", encoding="utf-8-sig", newline="") as f:
+		for n, row in enumerate(csv.reader(f)):
+			if not row or (n == 0 and row[0].strip().lower() == "student"):
+				continue
+			v = keys.variant(row[1] if len(row) > 1 else "", row[0].strip())
+			if v is None:
+				raise ValueError("line {}: unknown variant {}".format(n+1, row[1] if len(row) > 1 else ""))
+			answers = [response(a) for a in row[2:2+keys.count]]
+			answers += [_BLANK] * (keys.count - len(answers))
+			students.append(row[0].strip())
+			variants.append(v)
+			responses.append(answers)
+	return students, variants, responses
+
+def response(s):
+	s = s.strip().upper()
+	if s in _BLANK_MARKS:
+		return _BLANK
+	if len(s) == 1 and "A" <= s <= "Z":
+		return ord(s) - ord("A")
+	return _INVALID
+
+############################################################################
+# Grade all students: returns per student [correct, wrong, blank, score]
+# and per question (keys.questions) [students, correct, wrong, blank]
+############################################################################
+def grade(keys, variants, responses):
+	if numpy is not None:
+		return gradeArrays(keys, variants, responses)
+
+	scores = []
+	stats = [[0, 0, 0, 0] for q in keys.questions]
+	for v, answers in zip(variants, responses):
+		correct = wrong = blank = 0
+		for key, answer, q in zip(keys.rows[v], answers, keys.questionIndex[v]):
+			stats[q][0] += 1
+			if answer == _BLANK:
+				blank += 1
+				stats[q][3] += 1
+			elif answer == key:
+				correct += 1
+				stats[q][1] += 1
+			else:
+				wrong += 1
+				stats[q][2] += 1
+		scores.append([correct, wrong, blank, round(correct * keys.questionValue, 2)])
+	return scores, stats
+
+def gradeArrays(keys, variants, responses):
+	variants = numpy.array(variants, dtype=numpy.intp)
+	responses = numpy.array(responses, dtype=numpy.uint8).reshape(len(variants), keys.count)
+	blank = responses == _BLANK
+	correct = responses == keys.keys[variants]
+	wrong = ~(blank | correct)
+
+	counts = numpy.stack([correct.sum(axis=1), wrong.sum(axis=1), blank.sum(axis=1)], axis=1)
+	points = numpy.round(counts[:, 0] * keys.questionValue, 2)
+	scores = [[int(c), int(w), int(b), float(p)] for (c, w, b), p in zip(counts.tolist(), points.tolist())]
+
+	# statistics by question: bincount over the global index of each answer
+	index = keys.questionIndex[variants].ravel()
+	n = len(keys.questions)
+	stats = numpy.stack([
+		numpy.bincount(index, minlength=n),
+		numpy.bincount(index, weights=correct.ravel(), minlength=n),
+		numpy.bincount(index, weights=wrong.ravel(), minlength=n),
+		numpy.bincount(index, weights=blank.ravel(), minlength=n)], axis=1).astype(numpy.int64)
+	return scores, stats.tolist()
+
+############################################################################
+# Write scores (one row per student) and statistics (one row per question)
+############################################################################
+def writeScores(filename, keys, students, variants, scores):
+	with open(filename, "w", encoding="utf-8", newline="") as f:
+		writer = csv.writer(f)
+		writer.writerow(["student", "variant", "correct", "wrong", "blank", "score"])
+		for student, v, score in zip(students, variants, scores):
+			writer.writerow([student, keys.names[v]] + score)
+
+def writeStatistics(filename, keys, stats):
+	with open(filename, "w", encoding="utf-8", newline="") as f:
+		writer = csv.writer(f)
+		writer.writerow(["question", "students", "correct", "wrong", "blank", "correct_rate"])
+		for q, (students, correct, wrong, blank) in zip(keys.questions, stats):
+			writer.writerow([q, students, correct, wrong, blank, round(correct / students, 3) if students else ""])
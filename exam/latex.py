@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/latex.py
+"""Compilation of exam documents with pdflatex."""
+
+import os
+import shutil
+import hashlib
+
+from .files import copyFile
+
+
+_LATEX_COMMAND = ["pdflatex", "-interaction", "batchmode", "-no-shell-escape", "-output-directory", "."]
+_LATEX_RUNS = 2
+_STAMP_EXTENSION = ".build"
+
+# preamble dumped in a format with mylatexformat: documents compiled with
+# -fmt skip their preamble (up to \begin{document})
+_FORMAT_COMMAND = ["pdflatex", "-ini", "-interaction", "batchmode", "-no-shell-escape"]
+_FORMAT_PACKAGE = "mylatexformat.ltx"
+_FORMAT_EXTENSION = ".fmt"
+_FORMAT_FAILED = ".failed"
+_BEGIN_DOCUMENT = "\\begin{document}"
+
+# compile results
+COMPILED = "compiled"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+############################################################################
+# Helper : sha1 of file contents, None if file does not exist
+############################################################################
+def fileHash(filename):
+	if not os.path.exists(filename):
+		return None
+	h = hashlib.sha1()
+	with open(filename, "rb") as f:
+		for block in iter(lambda: f.read(65536), b""):
+			h.update(block)
+	return h.hexdigest()
+
+############################################################################
+# Hash of the inputs of document in path: its .tex files (document.tex and
+# document_*.tex) and shared files of the folder (class, logo, ...)
+############################################################################
+def inputsHash(path, document, shared=()):
+	names = [f for f in os.listdir(path) if f.endswith(".tex") and (f == document + ".tex" or f.startswith(document + "_"))]
+	h = hashlib.sha1()
+	for f in sorted(names) + sorted(shared):
+		h.update(f.encode("utf-8"))
+		h.update((fileHash(path + f) or "").encode("utf-8"))
+	return h.hexdigest()
+
+############################################################################
+# Compile document.tex in folder path (ending with /)
+# Skips compilation if inputs did not change since last successful build and
+# the second pass if the .aux file did not change.
+############################################################################
+def compileDocument(path, document, shared=(), force=False, fmt=None):
+	import subprocess
+
+	pdf = path + document + ".pdf"
+	aux = path + document + ".aux"
+	stamp = path + document + _STAMP_EXTENSION
+
+	inputs = inputsHash(path, document, shared)
+	if not force and os.path.exists(pdf) and os.path.exists(stamp):
+		with open(stamp, "r") as f:
+			if f.read() == inputs:
+				return SKIPPED
+
+	for f in [pdf, stamp]:
+		if os.path.exists(f):
+			os.remove(f)
+
+	def runs(command):
+		for run in range(_LATEX_RUNS):
+			before = fileHash(aux)
+			subprocess.call(command + [document + ".tex"], cwd=path, stdout=subprocess.DEVNULL)
+			if fileHash(aux) == before:
+				break
+
+	if fmt is not None:
+		runs(_LATEX_COMMAND + ["-fmt", fmt])
+	if not os.path.exists(pdf):
+		# without format (or again without it if compiling with it failed)
+		runs(_LATEX_COMMAND)
+	if not os.path.exists(pdf):
+		return FAILED
+
+	with open(stamp, "w") as f:
+		f.write(inputs)
+	return COMPILED
+
+############################################################################
+# Key of the preamble of document in path: its text before \begin{document}
+# (without comments), shared files and the pdflatex binary (a format only
+# loads in the pdflatex that dumped it)
+############################################################################
+def preambleKey(path, document, shared=()):
+	with open(path + document + ".tex", "r", encoding="utf-8") as f:
+		text = f.read()
+	begin = text.find(_BEGIN_DOCUMENT)
+	if begin < 0:
+		return None
+	h = hashlib.sha1()
+	for line in text[:begin].splitlines():
+		if not line.lstrip().startswith("%"):
+			h.update(line.encode("utf-8") + b"\n")
+	for f in sorted(shared):
+		h.update(f.encode("utf-8"))
+		h.update((fileHash(path + f) or "").encode("utf-8"))
+	binary = shutil.which("pdflatex")
+	if binary is not None:
+		h.update("{}:{}".format(binary, os.path.getmtime(binary)).encode("utf-8"))
+	return h.hexdigest()
+
+############################################################################
+# Format with the preamble of document in path, dumped once in formatDir
+# and rebuilt only when the preamble or shared files (class, ...) change.
+# The format is linked into path; returns its name (for -fmt), or None if
+# it can not be dumped (mylatexformat not installed, ...)
+############################################################################
+def preambleFormat(path, document, shared=(), formatDir=None):
+	import subprocess
+
+	key = preambleKey(path, document, shared)
+	if key is None or formatDir is None:
+		return None
+	name = "preamble_" + key
+	stored = formatDir + name + _FORMAT_EXTENSION
+	if os.path.exists(formatDir + name + _FORMAT_FAILED):
+		return None
+
+	try:
+		if not os.path.exists(stored):
+			os.makedirs(formatDir, exist_ok=True)
+			subprocess.call(_FORMAT_COMMAND + ["-jobname", name, "&pdflatex", _FORMAT_PACKAGE, document + ".tex"],
+				cwd=path, stdout=subprocess.DEVNULL)
+			for extension in (".log", ".pdf", ".aux"):
+				if os.path.exists(path + name + extension):
+					os.remove(path + name + extension)
+			if not os.path.exists(path + name + _FORMAT_EXTENSION):
+				# not tried again until the preamble changes
+				open(formatDir + name + _FORMAT_FAILED, "w").close()
+				return None
+			copyFile(path + name + _FORMAT_EXTENSION, stored, move=True)
+
+		target = path + name + _FORMAT_EXTENSION
+		if not os.path.exists(target):
+			try:
+				os.link(stored, target)
+			except OSError:
+				shutil.copyfile(stored, target)
+	except OSError:
+		# format is only an optimization
+		return None
+	return name
+
+############################################################################
+# Compile many documents in a pool of workers
+# jobs: list of (path, document, shared files, format or None); returns
+# results in order. profiler (optional) times the compilation of each
+# document
+############################################################################
+def compileDocuments(jobs, workers=None, force=False, profiler=None):
+	import concurrent.futures
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+		futures = [executor.submit(compileJob, path, document, shared, force, profiler, fmt) for path, document, shared, fmt in jobs]
+		return [future.result() for future in futures]
+
+def compileJob(path, document, shared, force, profiler, fmt=None):
+	if profiler is None:
+		return compileDocument(path, document, shared, force, fmt)
+	with profiler.stage("pdflatex " + document):
+		return compileDocument(path, document, shared, force, fmt)
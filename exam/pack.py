@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/pack.py
+"""Question bank compiled in one pack file, read through mmap.
+
+Layout of a pack file:
+    header   magic, version, length of index (struct _HEADER)
+    index    JSON: source path, loose files and one row per question
+             [directory, prefix, id, correct, mtime, size, offsets]
+    blob     UTF-8 statement and alternatives of all questions; offsets
+             of a row are (start, end) of the statement followed by
+             (start, end) of each alternative, relative to the blob
+"""
+
+import os
+import mmap
+import struct
+from collections.abc import Mapping
+
+from .bank import QuestionBank
+from .files import writeFile
+
+
+_MAGIC = b"EXAMPACK"
+_VERSION = 1
+_HEADER = struct.Struct("<8sIQ")
+
+_FIELDS = ("directory", "prefix", "id", "statement", "alternatives", "correct", "mtime", "size")
+_ROW = {"directory": 0, "prefix": 1, "id": 2, "correct": 3, "mtime": 4, "size": 5}
+
+
+############################################################################
+# Entry of a question in the pack: texts are decoded from the mmap only
+# when read, so questions not selected are never touched
+############################################################################
+class PackedQuestion(Mapping):
+
+	__slots__ = ("blob", "row")
+
+	def __init__(self, blob, row):
+		self.blob = blob
+		self.row = row
+
+	def text(self, i):
+		offsets = self.row[6]
+		return str(self.blob[offsets[2*i]:offsets[2*i+1]], "utf-8")
+
+	def __getitem__(self, key):
+		if key == "statement":
+			return self.text(0)
+		if key == "alternatives":
+			return [self.text(i) for i in range(1, len(self.row[6]) // 2)]
+		return self.row[_ROW[key]]
+
+	def __iter__(self):
+		return iter(_FIELDS)
+
+	def __contains__(self, key):
+		return key in _FIELDS
+
+	def __len__(self):
+		return len(_FIELDS)
+
+############################################################################
+# Question bank read from a pack file (mmap), rebuilt when question files
+# are newer than the pack
+############################################################################
+class PackedBank(QuestionBank):
+
+	def __init__(self, path, packFile, storage=None):
+		QuestionBank.__init__(self, path, storage=storage)
+		self.packFile = packFile
+		self.file = None
+		self.mmap = None
+
+	############################################################################
+	# Open the pack, refresh entries of changed files and rewrite it
+	############################################################################
+	def load(self):
+		self.open()
+		if self.refresh():
+			try:
+				self.save()
+			except OSError:
+				# pack is only a cache, questions are already loaded
+				pass
+		return self
+
+	def open(self):
+		import json
+		self.close()
+		self.directories = dict()
+		if not os.path.exists(self.packFile):
+			return
+		try:
+			self.file = open(self.packFile, "rb")
+			self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+			magic, version, length = _HEADER.unpack_from(self.mmap, 0)
+			if magic != _MAGIC or version != _VERSION:
+				self.close()
+				return
+			index = json.loads(str(self.mmap[_HEADER.size:_HEADER.size+length], "utf-8"))
+		except (OSError, ValueError, struct.error):
+			self.close()
+			return
+		if index["path"] != self.path:
+			self.close()
+			return
+		blob = memoryview(self.mmap)[_HEADER.size+length:]
+		self.loose = index["loose"]
+		for row in index["questions"]:
+			self.directories.setdefault(row[0], dict())[row[2]] = PackedQuestion(blob, row)
+
+	def close(self):
+		self.directories = dict()
+		self.prefixIndex = dict()
+		if self.mmap is not None:
+			try:
+				self.mmap.close()
+			except BufferError:
+				# texts still referenced, closed when collected
+				pass
+			self.mmap = None
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+	############################################################################
+	# Write all questions to the pack file and open it again
+	############################################################################
+	def save(self):
+		import json
+		self.fetchAll()
+		rows = []
+		blob = []
+		size = 0
+		for d in sorted(self.directories):
+			for entry in self.questions(d):
+				offsets = []
+				for text in [entry["statement"]] + entry["alternatives"]:
+					data = text.encode("utf-8")
+					offsets += [size, size + len(data)]
+					blob.append(data)
+					size += len(data)
+				rows.append([d, entry["prefix"], entry["id"], entry["correct"], entry["mtime"], entry["size"], offsets])
+		index = json.dumps({"path": self.path, "loose": self.loose, "questions": rows}).encode("utf-8")
+
+		writeFile(self.packFile, [_HEADER.pack(_MAGIC, _VERSION, len(index)), index] + blob)
+		self.open()
+
+	# new bank (not persisted, plain entries) only with questions keys
+	def subset(self, keys):
+		self.fetch(keys)
+		bank = QuestionBank(self.path, storage=self.storage)
+		for d, q_id in keys:
+			bank.directories.setdefault(d, dict())[q_id] = dict(self.get(d, q_id))
+		return bank
+
+	def __getstate__(self):
+		raise TypeError("PackedBank can not be pickled, use subset()")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/profiler.py
+"""Timing, counters and memory of the stages of exam generation."""
+
+import os
+import time
+import threading
+import contextlib
+
+
+############################################################################
+# Records stages (wall time and peak memory) and counters. A disabled
+# profiler records nothing.
+############################################################################
+class Profiler:
+
+	def __init__(self, enabled=False):
+		self.enabled = enabled
+		self.events = []      # Chrome trace events (complete events, microseconds)
+		self.counters = dict()
+		if enabled:
+			import tracemalloc
+			if not tracemalloc.is_tracing():
+				tracemalloc.start()
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		if not self.enabled:
+			yield
+			return
+		import tracemalloc
+		if hasattr(tracemalloc, "reset_peak"):
+			tracemalloc.reset_peak()
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			end = time.perf_counter()
+			self.events.append({
+				"name": name,
+				"ph": "X",
+				"ts": start * 1e6,
+				"dur": (end - start) * 1e6,
+				"pid": os.getpid(),
+				"tid": threading.get_ident(),
+				"args": {"memory_peak": tracemalloc.get_traced_memory()[1]}
+			})
+
+	def count(self, name, n=1):
+		if self.enabled:
+			self.counters[name] = self.counters.get(name, 0) + n
+
+	############################################################################
+	# Events and counters (to send from a worker process) and merge
+	############################################################################
+	def state(self):
+		return {"events": self.events, "counters": self.counters}
+
+	def merge(self, state):
+		if not self.enabled or state is None:
+			return
+		self.events += state["events"]
+		for name, n in state["counters"].items():
+			self.count(name, n)
+
+	############################################################################
+	# Summary of stages: name -> calls, total and max time (s), memory peak
+	############################################################################
+	def summary(self):
+		stages = dict()
+		for e in self.events:
+			s = stages.setdefault(e["name"], {"calls": 0, "total": 0.0, "max": 0.0, "memory_peak": 0})
+			s["calls"] += 1
+			s["total"] += e["dur"] / 1e6
+			s["max"] = max(s["max"], e["dur"] / 1e6)
+			s["memory_peak"] = max(s["memory_peak"], e["args"]["memory_peak"])
+		return stages
+
+	def maxRSS(self):
+		# KB on Linux
+		try:
+			import resource
+		except ImportError:
+			# not available on Windows
+			return None
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	def table(self):
+		lines = ["{:<32} {:>6} {:>10} {:>10} {:>12}".format("stage", "calls", "total(s)", "max(s)", "memory(KB)")]
+		for name, s in sorted(self.summary().items(), key=lambda i: -i[1]["total"]):
+			lines.append("{:<32} {:>6} {:>10.4f} {:>10.4f} {:>12}".format(name[:32], s["calls"], s["total"], s["max"], s["memory_peak"] // 1024))
+		for name in sorted(self.counters):
+			lines.append("{:<32} {:>6}".format(name[:32], self.counters[name]))
+		if self.maxRSS() is not None:
+			lines.append("{:<32} {:>6}".format("max RSS (KB)", self.maxRSS()))
+		return lines
+
+	############################################################################
+	# Write Chrome trace file (chrome://tracing or Perfetto) with summary and
+	# counters in otherData
+	############################################################################
+	def write(self, filename):
+		import json
+		trace = {
+			"traceEvents": self.events,
+			"displayTimeUnit": "ms",
+			"otherData": {"summary": self.summary(), "counters": self.counters, "max_rss": self.maxRSS()}
+		}
+		with open(filename, "w") as f:
+			json.dump(trace, f, indent=1)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/render.py
+"""Rendering of template files with [[FIELD]] placeholders."""
+
+import os
+import re
+import threading
+
+
+_PLACEHOLDER_REGEX = re.compile(r"\[\[([A-Z][A-Z0-9_]*)\]\]")
+
+# compiled templates: filename -> (mtime, size, tokens)
+_templates = dict()
+_lock = threading.Lock()
+
+
+############################################################################
+# Compile text of template in a list of tokens: text at even positions and
+# names of fields at odd positions
+############################################################################
+def compileTemplate(text):
+	return _PLACEHOLDER_REGEX.split(text)
+
+############################################################################
+# Tokens of template file, compiled once while the file does not change
+############################################################################
+def loadTemplate(filename):
+	st = os.stat(filename)
+	with _lock:
+		cached = _templates.get(filename)
+		if cached is not None and cached[0] == st.st_mtime and cached[1] == st.st_size:
+			return cached[2]
+	with open(filename, "r", encoding="utf-8") as f:
+		tokens = compileTemplate(f.read())
+	with _lock:
+		_templates[filename] = (st.st_mtime, st.st_size, tokens)
+	return tokens
+
+############################################################################
+# Text of tokens with fields (dict name -> value) in a single pass. Fields
+# not given are kept as [[FIELD]], so they can be rendered later.
+############################################################################
+def render(tokens, fields):
+	out = []
+	for i, token in enumerate(tokens):
+		if i % 2 == 0:
+			out.append(token)
+		elif token in fields:
+			out.append(str(fields[token]))
+		else:
+			out.append("[[" + token + "]]")
+	return "".join(out)
+
+def renderFile(filename, fields):
+	return render(loadTemplate(filename), fields)
+
+############################################################################
+# Text (a student name, ...) escaped to be used as a field in LaTeX
+############################################################################
+_LATEX_SPECIAL = {"\\": r"\textbackslash{}", "&": r"\&", "%": r"\%", "$": r"\$", "#": r"\#", "_": r"\_",
+	"{": r"\{", "}": r"\}", "~": r"\textasciitilde{}", "^": r"\textasciicircum{}"}
+
+def escapeLatex(s):
+	return "".join(_LATEX_SPECIAL.get(c, c) for c in " ".join(str(s).split()))
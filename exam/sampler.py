@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/sampler.py
+"""Random selection of questions of each type under restrictions."""
+
+
+_NO_CONFLICTS = frozenset()
+_SAMPLE_TRIES = 20          # uniform samples tried before searching
+_MAX_STEPS = 20000          # nodes of backtracking search
+
+
+############################################################################
+# Selection impossible: message and lines describing the blocking groups
+############################################################################
+class SelectionError(Exception):
+
+	def __init__(self, message, blocking=()):
+		Exception.__init__(self, message)
+		self.blocking = list(blocking)
+
+############################################################################
+# Select quantities[i] questions of each groups[i] (lists of names) with no
+# two conflicting questions (conflicts: name -> set of names) and no name
+# twice. returns the names chosen for each group (labels name the groups
+# in errors).
+#
+# First tries uniform samples of each group: an accepted sample is a
+# uniformly random valid selection. When restrictions are dense, searches
+# with backtracking only over questions that can conflict, and fills the
+# rest with free questions; the search also proves infeasibility.
+############################################################################
+def selectQuestions(rng, groups, quantities, conflicts, labels=None, stats=None):
+	if labels is None:
+		labels = ["group {}".format(i+1) for i in range(len(groups))]
+	if stats is None:
+		stats = dict()
+	stats.setdefault("checks", 0)
+	stats["samples"] = 0
+	stats["steps"] = 0
+
+	for label, names, quant in zip(labels, groups, quantities):
+		if quant > len(names):
+			raise SelectionError("{} has {} questions, {} needed".format(label, len(names), quant))
+
+	for t in range(_SAMPLE_TRIES):
+		stats["samples"] += 1
+		selection = sampleSelection(rng, groups, quantities, conflicts, stats)
+		if selection is not None:
+			return selection
+	return searchSelection(rng, groups, quantities, conflicts, labels, stats)
+
+def conflicting(conflicts, picked, q, stats):
+	stats["checks"] += 1
+	return q in picked or not conflicts.get(q, _NO_CONFLICTS).isdisjoint(picked)
+
+def sampleSelection(rng, groups, quantities, conflicts, stats):
+	picked = set()
+	selection = []
+	for names, quant in zip(groups, quantities):
+		chosen = rng.sample(names, quant)
+		for q in chosen:
+			if conflicting(conflicts, picked, q, stats):
+				return None
+			picked.add(q)
+		selection.append(chosen)
+	return selection
+
+############################################################################
+# Backtracking search: hard questions (in a restriction with another
+# candidate, or in two groups) are chosen first, groups with least slack
+# first, pruning when a group can not get enough questions anymore
+############################################################################
+def searchSelection(rng, groups, quantities, conflicts, labels, stats):
+
+	count = dict()
+	for names in groups:
+		for q in names:
+			count[q] = count.get(q, 0) + 1
+	def isHard(q):
+		return count[q] > 1 or any(c in count for c in conflicts.get(q, _NO_CONFLICTS))
+
+	def degree(q):
+		return sum(1 for c in conflicts.get(q, _NO_CONFLICTS) if c in count)
+
+	hard = []
+	free = []
+	need = []
+	for names, quant in zip(groups, quantities):
+		# random order, questions with fewer conflicts first
+		h = [q for q in names if isHard(q)]
+		rng.shuffle(h)
+		h.sort(key=degree)
+		hard.append(h)
+		free.append([q for q in names if not isHard(q)])
+		need.append(max(0, quant - len(free[-1])))
+
+	order = sorted((g for g in range(len(groups)) if need[g] > 0), key=lambda g: len(hard[g]) - need[g])
+	picked = set()
+	chosen = [[] for g in groups]
+
+	# questions restricted together form cliques: at most one of each clique
+	# can be picked. clique[q] is the clique of q in a partition of the hard
+	# questions of its group, made once
+	clique = dict()
+	for g, h in enumerate(hard):
+		for q in h:
+			if (g, q) in clique:
+				continue
+			members = [q]
+			for c in conflicts.get(q, _NO_CONFLICTS):
+				if c in h and (g, c) not in clique and all(c in conflicts.get(m, _NO_CONFLICTS) for m in members):
+					members.append(c)
+			for m in members:
+				clique[(g, m)] = q
+
+	# upper bound of questions of hard[g][start:] that can still be picked
+	def available(g, start):
+		return len({clique[(g, q)] for q in hard[g][start:] if not conflicting(conflicts, picked, q, stats)})
+
+	def feasible(i, g, start, k):
+		if available(g, start) < k:
+			return False
+		return all(available(h, 0) >= need[h] for h in order[i+1:])
+
+	# choose k more questions of group order[i] from hard[g][start:]
+	def search(i, start, k):
+		stats["steps"] += 1
+		if stats["steps"] > _MAX_STEPS:
+			raise SelectionError("no selection found in {} steps".format(_MAX_STEPS), blockingGroups(labels, hard, free, need, order, conflicts, count))
+		if i == len(order):
+			return True
+		g = order[i]
+		if k == 0:
+			return search(i+1, 0, need[order[i+1]] if i+1 < len(order) else 0)
+		for j in range(start, len(hard[g]) - k + 1):
+			q = hard[g][j]
+			if conflicting(conflicts, picked, q, stats):
+				continue
+			picked.add(q)
+			chosen[g].append(q)
+			if feasible(i, g, j+1, k-1) and search(i, j+1, k-1):
+				return True
+			picked.remove(q)
+			chosen[g].pop()
+		return False
+
+	if order and not search(0, 0, need[order[0]]):
+		raise SelectionError("restrictions leave too few questions", blockingGroups(labels, hard, free, need, order, conflicts, count))
+
+	# fill groups at random with questions not conflicting (free questions
+	# never conflict and are enough)
+	selection = []
+	for g, quant in enumerate(quantities):
+		pool = free[g] + [q for q in hard[g] if q not in picked]
+		rng.shuffle(pool)
+		for q in pool:
+			if len(chosen[g]) >= quant:
+				break
+			if not conflicting(conflicts, picked, q, stats):
+				picked.add(q)
+				chosen[g].append(q)
+		rng.shuffle(chosen[g])
+		selection.append(chosen[g])
+	return selection
+
+############################################################################
+# Report of groups needing questions in restrictions and the restrictions
+# (connected questions) involved
+############################################################################
+def blockingGroups(labels, hard, free, need, order, conflicts, count):
+	lines = []
+	seen = set()
+	for g in order:
+		lines.append("{}: needs {} of {} questions in restrictions ({} free questions)".format(labels[g], need[g], len(hard[g]), len(free[g])))
+		for q in hard[g]:
+			if q in seen:
+				continue
+			# questions connected to q by restrictions
+			component = {q}
+			stack = [q]
+			while stack:
+				for c in conflicts.get(stack.pop(), _NO_CONFLICTS):
+					if c in count and c not in component:
+						component.add(c)
+						stack.append(c)
+			seen |= component
+			lines.append("   restricted together: " + ", ".join(sorted(component)))
+	return lines
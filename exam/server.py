@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/server.py
+"""Local HTTP service generating exams (exam serve).
+
+Configuration and question bank stay loaded between requests.
+
+    GET  /health                         status and number of questions
+    POST /exams/<name>?variants=&seed=&pdf=1
+                                         body: exam YAML (as sample_exam.yaml)
+                                         returns generated .tex and answers
+    GET  /exams/<name>/<document>.pdf    202 while queued, then the PDF
+"""
+
+import os
+import io
+import re
+import sys
+import json
+import shutil
+import asyncio
+import contextlib
+import concurrent.futures
+from urllib.parse import urlsplit, parse_qs
+
+import yaml
+
+from .version import __version__
+from .exam import storeBuilds, formatDir, _FILES_TEMPLATE_GENERAL
+from .latex import compileDocument, preambleFormat, FAILED
+
+
+_NAME_REGEX = r"[A-Za-z0-9_-]+"
+_MAX_BODY = 1024 * 1024
+_MAX_PENDING = 256          # PDFs queued or compiling at once
+_EXAM_KEYS = ("class", "name", "date", "total_score")
+_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+	413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+# state of a queued PDF
+QUEUED = "queued"
+
+
+class RequestError(Exception):
+
+	def __init__(self, status, message):
+		Exception.__init__(self, message)
+		self.status = status
+
+############################################################################
+# Check the sessions of exam file examConfig read by generation, raises
+# RequestError (400) instead of failing inside it
+############################################################################
+def checkExamConfig(examConfig):
+	exam = examConfig["exam"]
+	if not isinstance(exam, dict):
+		raise RequestError(400, "exam session must have {}".format(", ".join(_EXAM_KEYS)))
+	missing = [key for key in _EXAM_KEYS if key not in exam]
+	if missing:
+		raise RequestError(400, "exam session needs {}".format(", ".join(missing)))
+	if not isinstance(exam["total_score"], (int, float)) or isinstance(exam["total_score"], bool):
+		raise RequestError(400, "total_score must be a number")
+	questions = examConfig.get("questions")
+	if questions is not None and (not isinstance(questions, dict) or
+			not all(isinstance(prefixes, dict) and all(c == "*" or (isinstance(c, int) and c >= 0) for c in prefixes.values()) for prefixes in questions.values())):
+		raise RequestError(400, "questions session must map folders to question types and quantities (a number or *)")
+	queries = examConfig.get("queries")
+	if queries is not None and (not isinstance(queries, list) or not all(isinstance(q, dict) and "count" in q for q in queries)):
+		raise RequestError(400, "queries session must be a list of queries with count")
+
+############################################################################
+# Exam generation service: one generation at a time (in a thread, off the
+# event loop) and a bounded pool of pdflatex workers
+############################################################################
+class ExamServer:
+
+	def __init__(self, builder, workers=None):
+		self.builder = builder
+		self.generator = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+		self.compiler = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+		self.pdfs = dict()      # document -> QUEUED or compile result
+		self.pending = dict()   # exam name -> task compiling its PDFs
+		self.locks = dict()     # exam name -> lock, one build of an exam at a time
+
+	def log(self, s):
+		# stdout of generation is captured, server log goes to stderr
+		print(s, file=sys.stderr)
+
+	async def handle(self, reader, writer):
+		target = ""
+		try:
+			try:
+				method, target, body = await self.readRequest(reader)
+				status, contentType, data = await self.route(method, target, body)
+			except RequestError as e:
+				status, contentType, data = e.status, "application/json", self.json({"error": str(e)})
+			except Exception as e:
+				status, contentType, data = 500, "application/json", self.json({"error": repr(e)})
+			self.log("{} {}".format(status, target))
+			writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+				status, _REASONS.get(status, ""), contentType, len(data)).encode("latin-1") + data)
+			await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def readRequest(self, reader):
+		try:
+			method, target, version = (await reader.readline()).decode("latin-1").split()
+		except ValueError:
+			raise RequestError(400, "malformed request line")
+		headers = dict()
+		while True:
+			line = await reader.readline()
+			if line in (b"\r\n", b"\n", b""):
+				break
+			name, sep, value = line.decode("latin-1").partition(":")
+			headers[name.strip().lower()] = value.strip()
+		try:
+			length = int(headers.get("content-length", "0"))
+		except ValueError:
+			raise RequestError(400, "Content-Length must be a number")
+		if length < 0:
+			raise RequestError(400, "Content-Length must not be negative")
+		if length > _MAX_BODY:
+			raise RequestError(413, "exam file too big")
+		body = await reader.readexactly(length) if length > 0 else b""
+		return method, target, body
+
+	def json(self, value):
+		return json.dumps(value, indent=1).encode("utf-8")
+
+	############################################################################
+	# Routes
+	############################################################################
+	async def route(self, method, target, body):
+		url = urlsplit(target)
+		query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+		parts = [p for p in url.path.split("/") if p]
+
+		if parts == ["health"]:
+			questions = sum(len(self.builder.bank.directories[d]) for d in self.builder.bank.directories)
+			return 200, "application/json", self.json({"status": "ok", "version": __version__, "questions": questions})
+
+		if len(parts) == 2 and parts[0] == "exams" and re.fullmatch(_NAME_REGEX, parts[1]):
+			if method != "POST":
+				raise RequestError(405, "use POST with the exam file")
+			return 200, "application/json", self.json(await self.generate(parts[1], body, query))
+
+		if len(parts) == 3 and parts[0] == "exams" and re.fullmatch(_NAME_REGEX, parts[1]) and parts[2].endswith(".pdf"):
+			return self.pdf(parts[1], parts[2][:-len(".pdf")])
+
+		raise RequestError(404, "not found")
+
+	############################################################################
+	# Generate exam name from exam YAML, PDFs queued if asked
+	############################################################################
+	async def generate(self, name, body, query):
+		try:
+			examConfig = yaml.safe_load(body.decode("utf-8"))
+		except (UnicodeDecodeError, yaml.YAMLError) as e:
+			raise RequestError(400, "invalid exam file: {}".format(e))
+		if not isinstance(examConfig, dict) or "exam" not in examConfig or ("questions" not in examConfig and "queries" not in examConfig):
+			raise RequestError(400, "exam file needs exam and questions (or queries) sessions")
+		checkExamConfig(examConfig)
+		try:
+			variants = int(query.get("variants", "1"))
+		except ValueError:
+			raise RequestError(400, "variants must be a number")
+		pdf = query.get("pdf", "0") not in ("0", "false", "")
+		if pdf and not shutil.which("pdflatex"):
+			raise RequestError(503, "pdflatex not installed")
+		if pdf and sum(1 for r in self.pdfs.values() if r == QUEUED) + variants > _MAX_PENDING:
+			raise RequestError(503, "too many PDFs queued, try again later")
+
+		async with self.locks.setdefault(name, asyncio.Lock()):
+			# files of exam are rewritten: wait for PDFs of the previous build
+			if name in self.pending:
+				await self.pending[name]
+
+			loop = asyncio.get_running_loop()
+			artifacts, output = await loop.run_in_executor(self.generator, self.build, name, examConfig, variants, query.get("seed"))
+			if artifacts is None:
+				lines = output.strip().splitlines()
+				raise RequestError(400, lines[-1] if lines else "generation failed")
+
+			if pdf:
+				for a in artifacts:
+					self.pdfs[a["name"]] = QUEUED
+				self.pending[name] = asyncio.ensure_future(self.compileAll(name, artifacts))
+
+		return {"exams": [{
+				"name": a["name"],
+				"answers": a["answers"],
+				"cached": a["cached"],
+				"files": {os.path.basename(f): self.read(f) for f in a["files"]},
+				"pdf": "/exams/{}/{}.pdf".format(name, a["name"]) if pdf else None
+			} for a in artifacts], "log": output}
+
+	def build(self, name, examConfig, variants, seed):
+		output = io.StringIO()
+		try:
+			with contextlib.redirect_stdout(output):
+				artifacts = self.builder.build(name, examConfig, variants, seed)
+		except SystemExit:
+			# error() of generation, message is in output
+			return None, output.getvalue()
+		return artifacts, output.getvalue()
+
+	def read(self, filename):
+		with open(filename, "r", encoding="utf-8") as f:
+			return f.read()
+
+	############################################################################
+	# PDFs of a build, compiled in the pool of workers
+	############################################################################
+	async def compileAll(self, name, artifacts):
+		loop = asyncio.get_running_loop()
+		try:
+			# variants share the preamble format of the first one
+			fmt = await loop.run_in_executor(self.compiler, preambleFormat, artifacts[0]["path"], artifacts[0]["name"], _FILES_TEMPLATE_GENERAL, formatDir(self.builder.config))
+			results = await asyncio.gather(*[loop.run_in_executor(self.compiler, compileDocument, a["path"], a["name"], _FILES_TEMPLATE_GENERAL, False, fmt) for a in artifacts],
+				return_exceptions=True)
+			for a, result in zip(artifacts, results):
+				self.pdfs[a["name"]] = FAILED if isinstance(result, Exception) else result
+			await loop.run_in_executor(self.generator, storeBuilds, self.builder.config, artifacts)
+		finally:
+			self.pending.pop(name, None)
+
+	def pdf(self, name, document):
+		result = self.pdfs.get(document)
+		if result is None or not (document == name or document.startswith(name + "_")):
+			raise RequestError(404, "PDF not requested")
+		if result == QUEUED:
+			return 202, "application/json", self.json({"status": QUEUED})
+		if result == FAILED:
+			raise RequestError(500, "pdflatex failed")
+		with open(self.builder.config.CWD + name + "/" + document + ".pdf", "rb") as f:
+			return 200, "application/pdf", f.read()
+
+############################################################################
+# Serve exams on host:port until interrupted
+############################################################################
+async def serve(builder, host="127.0.0.1", port=8765, workers=None):
+	service = ExamServer(builder, workers)
+	server = await asyncio.start_server(service.handle, host, port)
+	print("Serving exams on http://{}:{}/".format(host, port), file=sys.stderr)
+	async with server:
+		await server.serve_forever()
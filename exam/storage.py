@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+#coding: utf-8
+# exam/storage.py
+"""Storage of question files: a folder, a zip/tar archive or a SQLite database.
+
+A storage lists its files with mtime and size (to find changed questions
+without reading them) and reads many files in one call, get_many, so a
+slow storage is read once for all the questions needed instead of once
+for each file.
+
+    folder      <path>/<directory>/<file>
+    archive     .zip, .tar, .tar.gz, .tgz: <directory>/<file> members,
+                optionally inside one top folder
+    SQLite      .sqlite, .db: table questions(directory, name, mtime, size,
+                text), primary key (directory, name)
+"""
+
+import os
+import time
+import hashlib
+
+from .files import writeCacheFile
+
+
+_ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+_SQLITE_EXTENSIONS = (".sqlite", ".db")
+_SQLITE_BATCH = 400         # keys of one SELECT (2 parameters each, at most 999)
+_IGNORED = (".DS_Store",)
+
+_SQLITE_SCHEMA = """CREATE TABLE IF NOT EXISTS questions (
+	directory TEXT NOT NULL,
+	name TEXT NOT NULL,
+	mtime REAL NOT NULL,
+	size INTEGER NOT NULL,
+	text TEXT NOT NULL,
+	PRIMARY KEY (directory, name))"""
+
+
+############################################################################
+# Files of a folder
+############################################################################
+class DirectoryStorage:
+
+	def __init__(self, path):
+		self.path = path
+
+	# directory -> [(name, mtime, size)] and files outside directories
+	def list(self):
+		directories = dict()
+		loose = []
+		with os.scandir(self.path) as it:
+			for d in it:
+				if d.is_dir():
+					with os.scandir(d.path) as files:
+						directories[d.name] = [(f.name, st.st_mtime, st.st_size) for f, st in
+							((f, f.stat()) for f in files if f.is_file())]
+				elif d.is_file() and d.name not in _IGNORED:
+					loose.append(d.name)
+		loose.sort()
+		return directories, loose
+
+	# keys [(directory, name)] -> text
+	def get_many(self, keys):
+		texts = dict()
+		for d, name in keys:
+			with open(os.path.join(self.path, d, name), "r", encoding="utf-8") as f:
+				texts[(d, name)] = f.read()
+		return texts
+
+############################################################################
+# Members of a zip or tar archive, read in one pass over the archive
+############################################################################
+class ArchiveStorage:
+
+	def __init__(self, path):
+		self.path = path
+		self.members = None     # (directory, name) -> member name
+
+	def open(self):
+		if self.path.endswith(".zip"):
+			import zipfile
+			return zipfile.ZipFile(self.path)
+		import tarfile
+		return tarfile.open(self.path)
+
+	def entries(self, archive):
+		# (member name, mtime, size) of files
+		if self.path.endswith(".zip"):
+			return [(i.filename, time.mktime(i.date_time + (0, 0, -1)), i.file_size) for i in archive.infolist() if not i.is_dir()]
+		return [(m.name, m.mtime, m.size) for m in archive.getmembers() if m.isfile()]
+
+	def list(self):
+		with self.open() as archive:
+			entries = self.entries(archive)
+		parts = [(member.strip("/").split("/"), mtime, size) for member, mtime, size in entries]
+		# members inside one top folder (archive of the questions folder):
+		# top/directory/file; an archive of one question directory is not
+		tops = {p[0] for p, mtime, size in parts}
+		if len(tops) == 1 and all(len(p) > 2 for p, mtime, size in parts):
+			parts = [(p[1:], mtime, size) for p, mtime, size in parts]
+
+		directories = dict()
+		loose = []
+		self.members = dict()
+		for (p, mtime, size), (member, m, s) in zip(parts, entries):
+			if len(p) == 1 and p[0] not in _IGNORED:
+				loose.append(p[0])
+			elif len(p) == 2:
+				directories.setdefault(p[0], []).append((p[1], mtime, size))
+				self.members[(p[0], p[1])] = member
+		loose.sort()
+		return directories, loose
+
+	def get_many(self, keys):
+		if self.members is None:
+			self.list()
+		wanted = {self.members[key]: key for key in keys}
+		texts = dict()
+		with self.open() as archive:
+			if self.path.endswith(".zip"):
+				for member, key in wanted.items():
+					texts[key] = str(archive.read(member), "utf-8")
+			else:
+				# members in archive order: a compressed tar is read once
+				for m in archive:
+					if m.name in wanted:
+						texts[wanted[m.name]] = str(archive.extractfile(m).read(), "utf-8")
+		return texts
+
+############################################################################
+# Rows of a SQLite database, read with a few SELECTs
+############################################################################
+class SQLiteStorage:
+
+	def __init__(self, path):
+		self.path = path
+
+	def connect(self, create=False):
+		import sqlite3
+		if not create and not os.path.exists(self.path):
+			raise FileNotFoundError("database {} does not exist".format(self.path))
+		connection = sqlite3.connect(self.path)
+		connection.execute(_SQLITE_SCHEMA)
+		return connection
+
+	def list(self):
+		directories = dict()
+		connection = self.connect()
+		try:
+			for d, name, mtime, size in connection.execute("SELECT directory, name, mtime, size FROM questions ORDER BY directory, name"):
+				directories.setdefault(d, []).append((name, mtime, size))
+		finally:
+			connection.close()
+		return directories, []
+
+	def get_many(self, keys):
+		keys = list(keys)
+		texts = dict()
+		connection = self.connect()
+		try:
+			for i in range(0, len(keys), _SQLITE_BATCH):
+				# join of keys with the table: lookups in the primary key
+				batch = keys[i:i+_SQLITE_BATCH]
+				query = ("SELECT q.directory, q.name, q.text FROM (VALUES {}) k JOIN questions q ON q.directory = k.column1 AND q.name = k.column2"
+					.format(",".join(["(?, ?)"] * len(batch))))
+				for d, name, text in connection.execute(query, [v for key in batch for v in key]):
+					texts[(d, name)] = text
+		finally:
+			connection.close()
+		missing = [key for key in keys if key not in texts]
+		if missing:
+			raise KeyError("questions not in {}: {}".format(self.path, ", ".join(d + "/" + name for d, name in missing)))
+		return texts
+
+	# store files {(directory, name): (mtime, text)}
+	def put_many(self, files):
+		connection = self.connect(create=True)
+		try:
+			with connection:
+				connection.executemany("INSERT OR REPLACE INTO questions (directory, name, mtime, size, text) VALUES (?, ?, ?, ?, ?)",
+					[(d, name, mtime, len(text.encode("utf-8")), text) for (d, name), (mtime, text) in files.items()])
+		finally:
+			connection.close()
+
+	# remove files [(directory, name)]
+	def delete_many(self, keys):
+		connection = self.connect(create=True)
+		try:
+			with connection:
+				connection.executemany("DELETE FROM questions WHERE directory = ? AND name = ?", list(keys))
+		finally:
+			connection.close()
+
+############################################################################
+# Read-through local copy of the files of a (slow) storage: files read once
+# are kept in path, by location, name, mtime and size, and read from there
+############################################################################
+class CachedStorage:
+
+	def __init__(self, storage, path):
+		self.storage = storage
+		self.path = path
+		self.stats = dict()     # (directory, name) -> (mtime, size) of last list
+
+	def list(self):
+		directories, loose = self.storage.list()
+		self.stats = {(d, name): (mtime, size) for d in directories for name, mtime, size in directories[d]}
+		return directories, loose
+
+	# copy of key, None if not listed (its version is unknown)
+	def cacheFile(self, key):
+		stat = self.stats.get(key)
+		if stat is None:
+			return None
+		h = hashlib.sha1(repr((self.storage.path, key, stat)).encode("utf-8")).hexdigest()
+		return self.path + h[:2] + "/" + h + ".tex"
+
+	def get_many(self, keys):
+		texts = dict()
+		missing = []
+		for key in keys:
+			filename = self.cacheFile(key)
+			try:
+				with open(filename, "r", encoding="utf-8") as f:
+					texts[key] = f.read()
+			except (OSError, TypeError):
+				missing.append(key)
+		if missing:
+			fetched = self.storage.get_many(missing)
+			for key, text in fetched.items():
+				filename = self.cacheFile(key)
+				if filename is not None:
+					writeCacheFile(filename, text)
+			texts.update(fetched)
+		return texts
+
+############################################################################
+# Storage of location, by its extension (otherwise a folder); files read
+# through a local copy in cachePath if given
+############################################################################
+def storageKind(location):
+	if location.endswith(_ARCHIVE_EXTENSIONS):
+		return "archive"
+	if location.endswith(_SQLITE_EXTENSIONS):
+		return "sqlite"
+	return "directory"
+
+def openStorage(location, cachePath=None):
+	kind = storageKind(location)
+	if kind == "archive":
+		storage = ArchiveStorage(location)
+	elif kind == "sqlite":
+		storage = SQLiteStorage(location)
+	else:
+		storage = DirectoryStorage(location)
+	if cachePath is not None:
+		storage = CachedStorage(storage, cachePath)
+	return storage